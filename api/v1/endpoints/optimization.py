@@ -1,11 +1,18 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from core.config import settings
+from core.metrics import job_size, track_phase
 from models.booking import Booking
 from models.vehicle import VehicleModel
-from services.optimization_service import optimize_routes
+from services.optimization_service import optimize_routes, plan_matrix_requests
+from services.solution_cache import optimize_routes_cached
+from services.insertion_service import insert_bookings
 from pydantic import BaseModel, HttpUrl
+from datetime import datetime
+from typing import Optional
 import uuid
 import time
+import threading
 import requests
 
 # from app.utils.data_loader import read_csv_to_json
@@ -17,29 +24,38 @@ import json
 
 router = APIRouter()
 
-class LongRunningJobRequest(BaseModel):
+class OptimizationJobRequest(BaseModel):
     data: list[Booking]
     vehicles: list[VehicleModel]
+    # Optional bounds on the solver search: seconds of search and/or an absolute deadline
+    time_limit_seconds: Optional[float] = None
+    deadline: Optional[datetime] = None
+    # `clusters` of an earlier result for these bookings, used as the search's starting point
+    previous_clusters: Optional[list[dict]] = None
+
+class LongRunningJobRequest(OptimizationJobRequest):
     webhook_url: HttpUrl
 
 @router.post("/start-job-with-webhook")
 async def start_job_with_webhook(request: LongRunningJobRequest, background_tasks: BackgroundTasks):
     job_id = str(uuid.uuid4())
 
-    background_tasks.add_task(process_and_notify, job_id, request.data, request.vehicles, str(request.webhook_url))
+    background_tasks.add_task(process_and_notify, job_id, request.data, request.vehicles, str(request.webhook_url),
+                              request.time_limit_seconds, request.deadline, request.previous_clusters)
     return {"job_id": job_id, "message": "Job started. A webhook will be sent upon completion."}
 
-async def process_and_notify(job_id: str, data: list[Booking], vehicles: list[VehicleModel], webhook_url: str):
+async def process_and_notify(job_id: str, data: list[Booking], vehicles: list[VehicleModel], webhook_url: str,
+                             time_limit_seconds: Optional[float] = None, deadline: Optional[datetime] = None,
+                             previous_clusters: Optional[list[dict]] = None):
     print(f"Starting job {job_id} with bookings_data and webhook_url: {webhook_url}")
     
-    # Create semaphore to limit concurrent geocoding requests (adjust based on API limits)
-    # Google Maps API allows up to 50 QPS by default, so we use 10 concurrent requests
-    semaphore = asyncio.Semaphore(10)
-    
+    # Geocoding requests are throttled process-wide by the shared Google API limiter,
+    # so concurrent jobs together stay within the quota
   
     # # Process all bookings concurrently
-    tasks = [process_booking_geocoding(booking, semaphore) for booking in data]  
-    await asyncio.gather(*tasks)
+    with job_size(len(data)), track_phase("geocoding"):
+        tasks = [process_booking_geocoding(booking) for booking in data]  
+        await asyncio.gather(*tasks)
     
     bookings_data = []
   
@@ -51,7 +67,9 @@ async def process_and_notify(job_id: str, data: list[Booking], vehicles: list[Ve
         except ValueError as e:
             raise HTTPException(status_code=422, detail=f"Invalid booking data: {str(e)}")
     
-    optimized_routes = optimize_routes(data, vehicles)
+    # Keyed after geocoding, so the cache sees the resolved coordinates
+    optimized_routes = await optimize_routes_cached(data, vehicles, time_limit=time_limit_seconds, deadline=deadline,
+                                                    previous_clusters=previous_clusters)
     
     result = {"job_id": job_id, "status": "completed", "optimized_routes": optimized_routes}
     
@@ -62,6 +80,81 @@ async def process_and_notify(job_id: str, data: list[Booking], vehicles: list[Ve
     except requests.exceptions.RequestException as e:
         print(f"Failed to send webhook for job {job_id}: {e}")
 
+class StreamingJobRequest(OptimizationJobRequest):
+    # Results are streamed back on the request's own connection, so no webhook
+    pass
+
+@router.post("/optimize-stream")
+async def optimize_stream(request: StreamingJobRequest):
+    """Server-Sent Events stream of the search: a "solution" event for every improving
+    solution (`extract_solution` format plus objective, dropped_count and elapsed_seconds),
+    then one "result" event with the final plan. Closing the connection stops the search
+    within moments, keeping its best solution so far."""
+    with job_size(len(request.data)), track_phase("geocoding"):
+        await asyncio.gather(*[process_booking_geocoding(booking) for booking in request.data])
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    stop = threading.Event()
+
+    def on_solution(solution):
+        # Called on the solver thread
+        loop.call_soon_threadsafe(events.put_nowait, ("solution", solution))
+
+    async def solve():
+        try:
+            result = await asyncio.to_thread(optimize_routes, request.data, request.vehicles,
+                                             time_limit=request.time_limit_seconds, deadline=request.deadline,
+                                             previous_clusters=request.previous_clusters,
+                                             on_solution=on_solution, stop=stop)
+            await events.put(("result", result))
+        except Exception as e:
+            await events.put(("error", {"detail": str(e)}))
+
+    async def stream():
+        solver_task = asyncio.create_task(solve())
+        try:
+            while True:
+                event, payload = await events.get()
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+                if event != "solution":
+                    break
+        finally:
+            # Finished or client disconnected: ends the search if it is still running
+            stop.set()
+            print(f"Optimization stream closed ({'done' if solver_task.done() else 'stopping search'})")
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class InsertionRequest(BaseModel):
+    # Bookings of the current plan and the plan itself (`clusters` of an earlier result)
+    data: list[Booking]
+    vehicles: list[VehicleModel]
+    clusters: list[dict]
+    # Bookings to add to the plan
+    new_bookings: list[Booking]
+
+@router.post("/insert-bookings")
+async def insert_into_plan(request: InsertionRequest):
+    """Adds new bookings to an existing plan at their cheapest feasible positions, without re-solving."""
+    with job_size(len(request.data) + len(request.new_bookings)):
+        with track_phase("geocoding"):
+            await asyncio.gather(*[process_booking_geocoding(booking) for booking in request.new_bookings])
+        # Run in a worker thread so the event loop keeps serving requests meanwhile
+        return await asyncio.to_thread(insert_bookings, request.data, request.vehicles, request.clusters,
+                                       request.new_bookings)
+
+@router.post("/matrix-plan")
+async def get_matrix_plan(bookings: list[Booking]):
+    """Returns the Distance Matrix cost of optimizing these bookings before running it."""
+    with job_size(len(bookings)):
+        # Planned on the resolved coordinates, as the optimization would see them
+        with track_phase("geocoding"):
+            await asyncio.gather(*[process_booking_geocoding(booking) for booking in bookings])
+        # The feasibility pre-pass and cache lookups are CPU and disk bound; keep them off the event loop
+        return await asyncio.to_thread(plan_matrix_requests, bookings)
+
 @router.get('/')
 async def get_optimized_routes():
     
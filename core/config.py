@@ -1,13 +1,94 @@
+import os
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Default directory of the persistent caches, kept outside the source tree
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "route-optimization")
+
 class Settings(BaseSettings):
     GOOGLE_API_KEY: str
     PROJECT_NAME: str = "Taxi Route Optimization"
 
+    # Persistent pair-level store for Distance Matrix elements
+    MATRIX_CACHE_PATH: str = os.path.join(CACHE_DIR, "distance_matrix_cache.sqlite3")
+
+    # Offline PC6 postcode / house-number table (.npy written by save_postcode_table),
+    # tried before the geocode cache and Google; empty disables it
+    POSTCODE_TABLE_PATH: str = ""
+
+    # Persistent geocoding results keyed by normalized address (postcode + house number)
+    GEOCODE_CACHE_PATH: str = os.path.join(CACHE_DIR, "geocode_cache.sqlite3")
+
+    # Keep-alive connection pool and per-request timeout (s) of the async geocoding client
+    GEOCODE_MAX_CONNECTIONS: int = 100
+    GEOCODE_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    GEOCODE_TIMEOUT_SECONDS: float = 10.0
+
+    # Concurrent Distance Matrix tile fetches (further gated by the shared Google API limiter)
+    MATRIX_MAX_WORKERS: int = 8
+    # Distance Matrix elements per second (the API's own per-element quota)
+    MATRIX_ELEMENTS_PER_SECOND: float = 1000.0
+
+    # Process-wide budget shared by all Google Maps calls (geocoding and Distance Matrix)
+    GOOGLE_API_QPS: float = 10.0
+    # Bounds of the adaptive concurrency limit and the latency (s) it steers towards
+    GOOGLE_API_MIN_CONCURRENCY: int = 2
+    GOOGLE_API_MAX_CONCURRENCY: int = 32
+    GOOGLE_API_TARGET_LATENCY: float = 2.0
+    # Retries of throttled, timed-out or 5xx calls, with exponential backoff
+    GOOGLE_API_MAX_RETRIES: int = 5
+
+    # Width of the departure-time buckets for traffic-aware durations (0 disables bucketing)
+    TIME_BUCKET_SECONDS: int = 3600
+
+    # Skip matrix cells of arcs the time windows rule out, judged by straight-line
+    # distance at this speed (a lower bound on real driving time)
+    MATRIX_PRUNE_INFEASIBLE: bool = True
+    FEASIBILITY_MAX_SPEED_KMH: float = 130.0
+
+    # Matrix provider used by optimize_routes: "google", "haversine" (offline estimate)
+    # or "road_graph" (local search on ROAD_GRAPH_PATH)
+    MATRIX_PROVIDER: str = "google"
+    # Fall back to the offline estimate when the Distance Matrix API fails
+    MATRIX_FALLBACK_TO_ESTIMATE: bool = True
+
+    # Offline estimator defaults, replaced by values calibrated from cached Google cells
+    ESTIMATOR_DETOUR_FACTOR: float = 1.3
+    ESTIMATOR_SPEED_KMH: float = 65.0
+    ESTIMATOR_FIXED_SECONDS: int = 120
+
+    # Preprocessed road graph (.npz written by save_road_graph) for the local engine
+    ROAD_GRAPH_PATH: str = ""
+    # Road graph searches stop at this much driving time; farther pairs are unroutable
+    ROAD_GRAPH_MAX_SECONDS: float = 4 * 3600
+
+    # Default solver time limit: seconds per node x vehicle, clamped to [min, max]
+    SOLVER_SECONDS_PER_NODE_VEHICLE: float = 0.02
+    SOLVER_MIN_TIME_LIMIT: float = 2.0
+    SOLVER_MAX_TIME_LIMIT: float = 300.0
+    # Stop the search once the objective has not improved for this long (0 disables)
+    SOLVER_STALL_SECONDS: float = 10.0
+
+    # Search configurations solved in parallel worker processes, best plan wins (1 = single in-process solve)
+    SOLVER_PORTFOLIO_SIZE: int = 1
+    # Portfolio worker processes (0 = one per CPU core)
+    SOLVER_PORTFOLIO_WORKERS: int = 0
+
+    # Requests with more bookings are split by time band and geography into sub-problems
+    # of at most this size, solved in parallel and stitched (0 disables). Opt-in: it may
+    # serve fewer bookings than one whole solve, since no route can cross a part boundary
+    DECOMPOSITION_MAX_BOOKINGS: int = 0
+
+    # Optimization results kept in memory for identical requests, least recently used evicted (0 disables)
+    SOLUTION_CACHE_SIZE: int = 128
+
+    # Location matrices of this many recent service days kept in memory (per matrix provider);
+    # later optimization and insertion requests of the same day only compute new locations (0 disables)
+    MATRIX_STORE_DAYS: int = 2
+
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
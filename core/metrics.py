@@ -0,0 +1,88 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+
+# Job size label of the optimization running in the current context
+_job_size = ContextVar("job_size", default="unknown")
+
+PHASE_SECONDS = Histogram(
+    "route_optimization_phase_seconds",
+    "Wall time spent per optimization phase.",
+    ["phase", "job_size"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+
+MATRIX_API_ELEMENTS = Counter(
+    "distance_matrix_api_elements_total",
+    "Distance Matrix elements billed by Google.",
+    ["job_size"],
+)
+
+MATRIX_CACHE_HITS = Counter(
+    "distance_matrix_cache_hits_total",
+    "Distance Matrix elements served from the pair cache or an existing matrix.",
+    ["job_size"],
+)
+
+SOLVER_OBJECTIVE = Histogram(
+    "route_optimization_objective",
+    "Objective value of the returned routing solution.",
+    ["job_size"],
+    buckets=(1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11),
+)
+
+DROPPED_BOOKINGS = Counter(
+    "route_optimization_dropped_bookings_total",
+    "Bookings left unassigned by the solver.",
+    ["job_size"],
+)
+
+OPTIMIZATION_JOBS = Counter(
+    "route_optimization_jobs_total",
+    "Optimization runs by outcome.",
+    ["job_size", "outcome"],
+)
+
+SOLUTION_CACHE_REQUESTS = Counter(
+    "route_optimization_solution_cache_requests_total",
+    "Optimization requests by solution cache result: hit, shared (waited on a solve in flight) or miss.",
+    ["result"],
+)
+
+
+def size_bucket(num_bookings: int) -> str:
+    """Coarse job size label, so series stay few while still separating small and large jobs."""
+    for limit in (10, 50, 200, 1000):
+        if num_bookings <= limit:
+            return f"<={limit}"
+    return ">1000"
+
+
+def current_job_size() -> str:
+    return _job_size.get()
+
+
+@contextmanager
+def job_size(num_bookings: int):
+    """Labels every metric recorded inside the block with the job's size bucket."""
+    token = _job_size.set(size_bucket(num_bookings))
+    try:
+        yield
+    finally:
+        _job_size.reset(token)
+
+
+def observe_phase(phase: str, seconds: float) -> None:
+    PHASE_SECONDS.labels(phase, current_job_size()).observe(seconds)
+
+
+@contextmanager
+def track_phase(phase: str):
+    """Observes the wall time of the block in PHASE_SECONDS."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - start)
@@ -0,0 +1,149 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+# Dutch postcode: 4 digits (first one not 0) and 2 letters, e.g. "2625 KT"
+_POSTCODE = re.compile(r"\b([1-9]\d{3})\s*([a-z]{2})\b")
+
+# House number token, optionally with an attached addition: "86", "86a", "86-2", "86-hs"
+_HOUSE_NUMBER = re.compile(r"(\d{1,5})(?:-?([a-z0-9]{1,4}))?")
+
+# Separate addition token following the house number: "a", "bis", "034", "d10"
+_ADDITION = re.compile(r"[a-z0-9]{1,4}")
+
+# More separate addition tokens than this make the split ambiguous
+_MAX_ADDITION_TOKENS = 2
+
+
+def _split_house_number(text: str) -> Optional[Tuple[int, str]]:
+    """
+    Finds (house number, addition) in the address text on one side of the postcode.
+
+    The house number is the first number token that follows a word of the street
+    name; everything after it within the same comma-separated part is kept as the
+    addition. Returns None when there is no such number or the rest does not look
+    like an addition.
+    """
+    for part in text.split(","):
+        # "86 - 2" -> "86-2"
+        tokens = re.sub(r"\s*-\s*", "-", part).split()
+        for i, token in enumerate(tokens):
+            match = _HOUSE_NUMBER.fullmatch(token)
+            if not match or not any(c.isalpha() for word in tokens[:i] for c in word):
+                continue
+            rest = tokens[i + 1:]
+            if len(rest) > _MAX_ADDITION_TOKENS or not all(_ADDITION.fullmatch(word) for word in rest):
+                return None
+            additions = [match.group(2)] if match.group(2) else []
+            return int(match.group(1)), "-".join(additions + rest).upper()
+    return None
+
+
+def parse_dutch_address(address: str) -> Tuple[Optional[str], Optional[int], str]:
+    """
+    Extracts (postcode, house number, addition) from an address.
+
+    The house number is the first number after the street name (street names
+    like "2e Hugo de Grootstraat" contain numbers too), before the postcode or
+    else after it. Everything following it is the addition, so a unit such as
+    "034" or "D10" keeps addresses in one building apart. When the house number
+    is missing or the rest cannot be read as an addition, the house number is
+    None (addition ""), and callers do not guess one.
+
+    >>> parse_dutch_address("Koetlaan 86A, 2625 KT Delft")
+    ('2625KT', 86, 'A')
+    >>> parse_dutch_address("2e Hugo de Grootstraat 12 1052KX Amsterdam")
+    ('1052KX', 12, '')
+    >>> parse_dutch_address("Sint Oloflaan 1 034 5037EP Tilburg")
+    ('5037EP', 1, '034')
+    >>> parse_dutch_address("Sint Oloflaan 34 5037EP Tilburg")
+    ('5037EP', 34, '')
+    >>> parse_dutch_address("Overakkerstraat 105 D10 4834XK Breda")
+    ('4834XK', 105, 'D10')
+    >>> parse_dutch_address("Overakkerstraat 105 D11 4834XK Breda")
+    ('4834XK', 105, 'D11')
+    >>> parse_dutch_address("Hoge Maasdijk 42 b 4281NG Andel")
+    ('4281NG', 42, 'B')
+    >>> parse_dutch_address("Koetlaan 86 achter de kerk 2625KT Delft")
+    ('2625KT', None, '')
+    """
+    text = " ".join(address.casefold().split())
+
+    postcode = _POSTCODE.search(text)
+    if not postcode:
+        return None, None, ""
+    code = f"{postcode.group(1)}{postcode.group(2).upper()}"
+
+    before = text[:postcode.start()]
+    # Only look past the postcode when there is no number before it at all
+    split = _split_house_number(before) if re.search(r"\d", before) else _split_house_number(text[postcode.end():])
+    if split is None:
+        return code, None, ""
+    house_number, addition = split
+    return code, house_number, addition
+
+
+def normalize_address(address: str) -> str:
+    """
+    Builds the geocode cache key for an address.
+
+    Dutch addresses reduce to postcode + house number + addition, so textual
+    variants such as "Koetlaan 86 2625KT Delft" and "koetlaan 86, 2625 KT Delft"
+    share the key "2625KT|86|". Addresses without a postcode and house number, or
+    whose addition cannot be read, fall back to the casefolded text with
+    punctuation and whitespace collapsed, so they only match themselves.
+    """
+    postcode, house_number, addition = parse_dutch_address(address)
+    if postcode and house_number is not None:
+        return f"{postcode}|{house_number}|{addition}"
+
+    text = " ".join(address.casefold().split())
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+_TABLE = "geocodes"
+
+
+class GeocodeCache:
+    """
+    Persistent store of geocoding results keyed by normalized address.
+
+    Only successful lookups are stored; the raw address is kept alongside the
+    coordinates for inspection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {_TABLE} (
+                    key TEXT PRIMARY KEY,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    address TEXT NOT NULL
+                )
+                """
+            )
+
+    def get(self, key: str) -> Optional[Tuple[float, float]]:
+        """Returns the cached (lat, lng) for a normalized address key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT latitude, longitude FROM {_TABLE} WHERE key = ?", (key,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key: str, location: Tuple[float, float], address: str) -> None:
+        """Stores the (lat, lng) of an address, replacing an older value."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {_TABLE} (key, latitude, longitude, address) VALUES (?, ?, ?, ?)",
+                (key, location[0], location[1], address),
+            )
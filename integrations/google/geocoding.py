@@ -1,20 +1,94 @@
 import googlemaps
+import httpx
 from core.config import settings
-import asyncio
-from typing import Tuple
+from integrations.google.geocode_cache import GeocodeCache, normalize_address
+from integrations.google.rate_limiter import google_api_limiter
+from integrations.offline.postcode_geocoder import geocode_postcode
+from utils.single_flight import SingleFlight
+from typing import Optional, Tuple
 
-gmaps = googlemaps.Client(key=settings.GOOGLE_API_KEY)
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+
+class AsyncGeocodingClient:
+    """
+    Native asyncio client for the Geocoding API on a bounded keep-alive connection pool.
+
+    Failures are raised as the googlemaps client's exceptions (Timeout,
+    TransportError, HTTPError, ApiError) so the shared limiter classifies and
+    retries them the same way for every Google call.
+    """
+
+    def __init__(self, key: str, max_connections: int, max_keepalive_connections: int, timeout: float):
+        self.key = key
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections)
+        self.timeout = httpx.Timeout(timeout)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use, inside the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._client
+
+    async def geocode(self, address: str) -> list:
+        """Returns the Geocoding API results for an address ([] when nothing matched)."""
+        try:
+            response = await self.client.get(GEOCODE_URL, params={"address": address, "key": self.key})
+        except httpx.TimeoutException:
+            raise googlemaps.exceptions.Timeout()
+        except httpx.TransportError as e:
+            raise googlemaps.exceptions.TransportError(e)
+
+        if response.status_code != 200:
+            raise googlemaps.exceptions.HTTPError(response.status_code)
+
+        body = response.json()
+        if body["status"] == "ZERO_RESULTS":
+            return []
+        if body["status"] != "OK":
+            raise googlemaps.exceptions.ApiError(body["status"], body.get("error_message"))
+        return body["results"]
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+geocoding_client = AsyncGeocodingClient(
+    settings.GOOGLE_API_KEY,
+    settings.GEOCODE_MAX_CONNECTIONS,
+    settings.GEOCODE_MAX_KEEPALIVE_CONNECTIONS,
+    settings.GEOCODE_TIMEOUT_SECONDS,
+)
+
+geocode_cache = GeocodeCache(settings.GEOCODE_CACHE_PATH)
+
+# Pending lookups by normalized address, shared by every booking and job in the process
+_lookups = SingleFlight()
+
+async def _geocode_and_store(key: str, address: str) -> Tuple[float, float]:
+    result = await google_api_limiter.call_async(geocoding_client.geocode, address)
+    if result:
+        location = result[0]['geometry']['location']
+        geocode_cache.put(key, (location['lat'], location['lng']), address)
+        return location['lat'], location['lng']
+    raise ValueError(f"Geocoding failed for address: {address}")
 
 async def geocode_address_async(address: str) -> Tuple[float, float]:
-    """Async wrapper for geocoding using ThreadPoolExecutor"""
-    loop = asyncio.get_event_loop()
-    
-    def _geocode():
-        result = gmaps.geocode(address)
-        if result:
-            location = result[0]['geometry']['location']
-            return location['lat'], location['lng']
-        raise ValueError(f"Geocoding failed for address: {address}")
-    
-    # Run the blocking geocoding call in a thread pool
-    return await loop.run_in_executor(None, _geocode)
\ No newline at end of file
+    """Async geocoding, cheapest tier first: the offline postcode table, then the persistent
+    geocode cache, then Google through the process-wide API limiter (written back to the cache).
+    Concurrent calls for the same normalized address share one pending lookup."""
+    location = geocode_postcode(address)
+    if location:
+        return location
+
+    key = normalize_address(address)
+    cached = geocode_cache.get(key)
+    if cached:
+        return cached
+
+    return await _lookups.run(key, _geocode_and_store, key, address)
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+# 5 decimals is roughly 1 m, well below geocoding precision
+COORDINATE_PRECISION = 5
+
+# SQLite's default limit on bound parameters is 999
+_QUERY_CHUNK = 500
+
+
+def location_key(location) -> str:
+    """Builds the cache key for a (lat, lng) location, rounded to ~1 m."""
+    lat, lng = location
+    return f"{lat:.{COORDINATE_PRECISION}f},{lng:.{COORDINATE_PRECISION}f}"
+
+
+class MatrixCache:
+    """
+    Persistent store of Distance Matrix elements keyed by origin/destination pair.
+
+    Each row holds one matrix cell (distance in meters, duration in seconds) for a
+    travel profile such as 'driving'. Only elements Google returned as OK are
+    stored, so unroutable pairs are requested again on the next job.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS matrix_cells (
+                    origin TEXT NOT NULL,
+                    destination TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    distance INTEGER NOT NULL,
+                    duration INTEGER NOT NULL,
+                    PRIMARY KEY (origin, destination, profile)
+                )
+                """
+            )
+
+    def get_many(self, origins: Iterable[str], destinations: Iterable[str],
+                 profile: str) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        """Returns {(origin, destination): (distance, duration)} for every cached pair."""
+        origins = list(dict.fromkeys(origins))
+        wanted_destinations = set(destinations)
+        cells = {}
+
+        with self._lock:
+            for start in range(0, len(origins), _QUERY_CHUNK):
+                chunk = origins[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT origin, destination, distance, duration FROM matrix_cells "
+                    f"WHERE profile = ? AND origin IN ({placeholders})",
+                    [profile, *chunk],
+                )
+                for origin, destination, distance, duration in rows:
+                    if destination in wanted_destinations:
+                        cells[(origin, destination)] = (distance, duration)
+
+        return cells
+
+    def put_many(self, cells: List[Tuple[str, str, int, int]], profile: str) -> None:
+        """Stores (origin, destination, distance, duration) cells, replacing older values."""
+        if not cells:
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO matrix_cells "
+                "(origin, destination, profile, distance, duration) VALUES (?, ?, ?, ?, ?)",
+                [(origin, destination, profile, distance, duration)
+                 for origin, destination, distance, duration in cells],
+            )
+
+    def sample(self, profile: str, limit: int = 50000) -> List[Tuple[str, str, int, int]]:
+        """Returns up to `limit` cached (origin, destination, distance, duration) cells for a
+        profile, including its departure-time variants ('<profile>@HH:MM')."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT origin, destination, distance, duration FROM matrix_cells "
+                "WHERE profile = ? OR profile LIKE ? LIMIT ?",
+                (profile, f"{profile}@%", limit),
+            ).fetchall()
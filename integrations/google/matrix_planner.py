@@ -0,0 +1,114 @@
+from math import ceil
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Distance Matrix API limits per request
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+# When comparing candidate plans, one extra round trip is treated as costing
+# as much as this many billed elements
+REQUEST_COST = 10
+
+Tile = Tuple[List[int], List[int]]
+
+
+def _best_shape(num_rows: int, num_cols: int) -> Tuple[int, int]:
+    """Returns the (rows, cols) tile shape that covers a num_rows x num_cols block in the fewest requests."""
+    best = None
+    for cols in range(1, min(MAX_DESTINATIONS, num_cols) + 1):
+        rows = min(MAX_ORIGINS, MAX_ELEMENTS // cols, num_rows)
+        requests = ceil(num_rows / rows) * ceil(num_cols / cols)
+        if best is None or requests < best[0]:
+            best = (requests, rows, cols)
+    return best[1], best[2]
+
+
+def _tile_block(rows: Sequence[int], cols: Sequence[int]) -> List[Tile]:
+    """Covers every cell of rows x cols with requests within the API limits."""
+    tile_rows, tile_cols = _best_shape(len(rows), len(cols))
+    return [
+        (list(rows[r:r + tile_rows]), list(cols[c:c + tile_cols]))
+        for r in range(0, len(rows), tile_rows)
+        for c in range(0, len(cols), tile_cols)
+    ]
+
+
+def _grouped_plan(needed_by_row: Dict[int, Tuple[int, ...]]) -> List[Tile]:
+    """Groups rows needing exactly the same columns; bills only needed cells."""
+    groups = {}
+    for row, cols in needed_by_row.items():
+        groups.setdefault(cols, []).append(row)
+
+    tiles = []
+    for cols, rows in groups.items():
+        tiles.extend(_tile_block(rows, cols))
+    return tiles
+
+
+def _transpose(tiles: List[Tile]) -> List[Tile]:
+    return [(cols, rows) for rows, cols in tiles]
+
+
+def _banded_plan(needed: np.ndarray) -> List[Tile]:
+    """Fixed 4x25 bands of the full matrix, trimmed to rows/columns with needed cells."""
+    num_rows, num_cols = needed.shape
+    band_rows = MAX_ELEMENTS // MAX_DESTINATIONS
+    tiles = []
+    for i in range(0, num_rows, band_rows):
+        for j in range(0, num_cols, MAX_DESTINATIONS):
+            band = needed[i:i + band_rows, j:j + MAX_DESTINATIONS]
+            rows = np.flatnonzero(band.any(axis=1))
+            if rows.size == 0:
+                continue
+            cols = np.flatnonzero(band[rows].any(axis=0))
+            tiles.append(((rows + i).tolist(), (cols + j).tolist()))
+    return tiles
+
+
+def summarize_plan(tiles: List[Tile], needed) -> dict:
+    """Reports what a plan will cost: requests, billed elements and how many of those are wasted."""
+    needed_elements = int(np.count_nonzero(needed))
+    billed_elements = sum(len(rows) * len(cols) for rows, cols in tiles)
+    return {
+        "requests": len(tiles),
+        "needed_elements": needed_elements,
+        "billed_elements": billed_elements,
+        "wasted_elements": billed_elements - needed_elements,
+    }
+
+
+def plan_requests(needed) -> List[Tile]:
+    """
+    Lays out Distance Matrix requests covering every needed cell.
+
+    `needed` is a 2D boolean array (origins x destinations) of the cells that are
+    still required, i.e. not cached, not on the diagonal and not pruned. Several
+    candidate layouts are built (rows grouped by identical column sets, the same
+    grouped by column, and trimmed fixed bands) and the one with the lowest
+    billed elements + REQUEST_COST * requests is returned as a list of
+    (origin_indices, destination_indices) tiles.
+    """
+    needed = np.asarray(needed, dtype=bool)
+    if not needed.any():
+        return []
+
+    needed_by_row = {
+        int(r): tuple(np.flatnonzero(needed[r]).tolist()) for r in np.flatnonzero(needed.any(axis=1))
+    }
+    needed_by_col = {
+        int(c): tuple(np.flatnonzero(needed[:, c]).tolist()) for c in np.flatnonzero(needed.any(axis=0))
+    }
+
+    candidates = [
+        _grouped_plan(needed_by_row),
+        _transpose(_grouped_plan(needed_by_col)),
+        _banded_plan(needed),
+    ]
+
+    def cost(tiles):
+        return sum(len(rows) * len(cols) for rows, cols in tiles) + REQUEST_COST * len(tiles)
+
+    return min(candidates, key=cost)
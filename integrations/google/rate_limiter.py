@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import inspect
+import random
+import threading
+import time
+from typing import Optional
+
+import googlemaps
+from core.config import settings
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep Google API calls under a QPS budget.
+
+    `rate` tokens are added per second up to `capacity`; `acquire` blocks until
+    a token is available. Requests for more than `capacity` tokens are served in
+    chunks of `capacity`, so they wait for the rate instead of never completing.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, tokens: float) -> float:
+        """Consumes `tokens` if available and returns 0, else the seconds until they will be."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def _chunks(self, tokens: float) -> list:
+        # More than `capacity` tokens are never available at once, so they are taken in chunks
+        chunks = [self.capacity] * int(tokens // self.capacity)
+        if tokens % self.capacity:
+            chunks.append(tokens % self.capacity)
+        return chunks
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Blocks until `tokens` tokens are available and consumes them."""
+        for chunk in self._chunks(tokens):
+            wait = self._take(chunk)
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._take(chunk)
+
+    async def acquire_async(self, tokens: float = 1.0) -> None:
+        """Like `acquire`, but waits without blocking the event loop."""
+        for chunk in self._chunks(tokens):
+            wait = self._take(chunk)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._take(chunk)
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a failed Google call is worth retrying: throttling, timeouts and server-side errors."""
+    if isinstance(error, googlemaps.exceptions.HTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, (googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError)):
+        return True
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+    return False
+
+
+class GoogleApiLimiter:
+    """
+    Process-wide gate for Google Maps calls, shared by geocoding and the Distance Matrix.
+
+    Every attempt takes a token from one QPS bucket and a slot under a
+    concurrency limit. The limit adapts AIMD-style: it grows by one slot per
+    `limit` healthy calls, shrinks by half on a throttling or timeout error and
+    by 10% when the smoothed latency exceeds the target. Transient failures
+    (see `is_transient_error`) are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, qps: float, min_concurrency: int, max_concurrency: int,
+                 max_retries: int, target_latency: float, backoff_seconds: float = 0.5,
+                 max_backoff_seconds: float = 30.0):
+        self.bucket = TokenBucket(qps)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.target_latency = target_latency
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.limit = float(self.min_concurrency)
+        self.in_flight = 0
+        self.latency = None
+        self._condition = threading.Condition()
+        # Coroutines waiting for a slot, as (event loop, future); woken by `_leave` from any thread
+        self._async_waiters = []
+
+    def _enter(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def _leave(self, latency: Optional[float], error: Exception = None) -> None:
+        # latency is None when the attempt never completed (e.g. cancelled): only the slot is released
+        with self._condition:
+            self.in_flight -= 1
+            if error is not None and is_transient_error(error):
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            elif error is None and latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                if self.latency > self.target_latency:
+                    self.limit = max(self.min_concurrency, self.limit * 0.9)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # The waiter's event loop has been closed
+                pass
+
+    async def _enter_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self._condition:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def call(self, fn, *args, **kwargs):
+        """Runs the blocking `fn(*args, **kwargs)` under the limiter, retrying transient errors."""
+        for attempt in range(self.max_retries + 1):
+            self._enter()
+            latency, error = None, None
+            # The slot is released in `finally`, so an interrupted attempt cannot leak it
+            try:
+                self.bucket.acquire()
+                started = time.monotonic()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    latency, error = time.monotonic() - started, e
+                    if not is_transient_error(e) or attempt == self.max_retries:
+                        raise
+                    print(f"Google API call failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                else:
+                    latency = time.monotonic() - started
+                    return result
+            finally:
+                self._leave(latency, error)
+            time.sleep(self._backoff(attempt))
+
+    async def call_async(self, fn, *args, **kwargs):
+        """Like `call` from a coroutine: waits on the event loop, then awaits `fn` if it is a
+        coroutine function or runs it in the default executor otherwise."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self._enter_async()
+            latency, error = None, None
+            # Released in `finally` too, so a cancelled coroutine gives its slot back
+            try:
+                await self.bucket.acquire_async()
+                started = time.monotonic()
+                try:
+                    if inspect.iscoroutinefunction(fn):
+                        result = await fn(*args, **kwargs)
+                    else:
+                        result = await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+                except Exception as e:
+                    latency, error = time.monotonic() - started, e
+                    if not is_transient_error(e) or attempt == self.max_retries:
+                        raise
+                    print(f"Google API call failed ({e}), retry {attempt + 1}/{self.max_retries}")
+                else:
+                    latency = time.monotonic() - started
+                    return result
+            finally:
+                self._leave(latency, error)
+            await asyncio.sleep(self._backoff(attempt))
+
+
+google_api_limiter = GoogleApiLimiter(
+    settings.GOOGLE_API_QPS,
+    settings.GOOGLE_API_MIN_CONCURRENCY,
+    settings.GOOGLE_API_MAX_CONCURRENCY,
+    settings.GOOGLE_API_MAX_RETRIES,
+    settings.GOOGLE_API_TARGET_LATENCY,
+)
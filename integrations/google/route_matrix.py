@@ -1,85 +1,250 @@
 import googlemaps
+import numpy as np
 from core.config import settings
-import json
-import os
-
-gmaps = googlemaps.Client(key=settings.GOOGLE_API_KEY)
-
-CACHE_FILE = "distance_matrix_cache.json"
+from core.metrics import current_job_size, MATRIX_API_ELEMENTS, MATRIX_CACHE_HITS
+from integrations.google.matrix_cache import MatrixCache, location_key
+from integrations.google.matrix_planner import plan_requests, summarize_plan
+from integrations.google.rate_limiter import TokenBucket, google_api_limiter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+# Throttling and 5xx errors are retried by google_api_limiter, which also adapts its concurrency
+# to them; a retry_timeout shorter than any request makes the client raise Timeout instead of
+# retrying on its own
+gmaps = googlemaps.Client(key=settings.GOOGLE_API_KEY, retry_over_query_limit=False, retry_timeout=0.001)
+
+matrix_cache = MatrixCache(settings.MATRIX_CACHE_PATH)
+
+# Element budget shared by all concurrent tile fetches in this process; the
+# request itself also goes through the process-wide google_api_limiter
+matrix_rate_limiter = TokenBucket(settings.MATRIX_ELEMENTS_PER_SECOND)
+
+TRAVEL_MODE = "driving"
+
+# Failures of the Distance Matrix API that callers may degrade on
+MATRIX_API_ERRORS = (
+    googlemaps.exceptions.ApiError,
+    googlemaps.exceptions.HTTPError,
+    googlemaps.exceptions.Timeout,
+    googlemaps.exceptions.TransportError,
+)
 
 def build_matrices(response):
     """Builds distance and time sub-matrices from Distance Matrix API response.
-       Ensures consistent [num_origins x num_destinations] shape."""
-    distance_matrix = []
-    time_matrix = []
+       Ensures consistent [num_origins x num_destinations] shape (int32 arrays)."""
+    rows = response.get("rows", [])
+    num_cols = len(rows[0].get("elements", [])) if rows else 0
 
-    for row in response.get("rows", []):
-        dist_row, time_row = [], []
-        for element in row.get("elements", []):
+    # If no route, assign large penalties
+    distance_matrix = np.full((len(rows), num_cols), 10**9, dtype=np.int32)
+    time_matrix = np.full((len(rows), num_cols), 10**9, dtype=np.int32)
+
+    for i, row in enumerate(rows):
+        for j, element in enumerate(row.get("elements", [])):
             if element.get("status") == "OK":
                 # Distance in meters
-                dist_row.append(element["distance"]["value"])
-                # Duration in seconds
-                time_row.append(element["duration"]["value"])
-            else:
-                # If no route, assign large penalties
-                dist_row.append(10**9)
-                time_row.append(10**9)
-        distance_matrix.append(dist_row)
-        time_matrix.append(time_row)
+                distance_matrix[i, j] = element["distance"]["value"]
+                # Duration in seconds, traffic-aware when a departure time was sent
+                duration = element.get("duration_in_traffic") or element["duration"]
+                time_matrix[i, j] = duration["value"]
 
     return distance_matrix, time_matrix
 
 
-def create_matrices(addresses, force_refresh=False):
-    """Builds both distance and time matrices for given addresses."""
-    # if not force_refresh and os.path.exists(CACHE_FILE):
-    #     with open(CACHE_FILE, "r") as f:
-    #         cache = json.load(f)
-    #         return cache["distance_matrix"], cache["time_matrix"]
+def travel_profile(departure_time=None) -> str:
+    """Pair-cache profile: the travel mode, plus the departure time of day when traffic-aware."""
+    if departure_time is None:
+        return TRAVEL_MODE
+    return f"{TRAVEL_MODE}@{departure_time:%H:%M}"
 
-    num_addresses = len(addresses)
-    distance_matrix = [[0] * num_addresses for _ in range(num_addresses)]
-    time_matrix = [[0] * num_addresses for _ in range(num_addresses)]
 
-    max_elements = 100
-    max_origins = 25
-    max_destinations = 25
-    max_rows = min(max_elements // max_destinations, max_origins)
-    max_cols = min(max_elements // max_rows, max_destinations)
+def _future_departure(departure_time: datetime) -> datetime:
+    """Google only accepts departure times in the future; move past ones forward by whole weeks
+    so the weekday and time of day (and thus the typical traffic) stay the same."""
+    if departure_time.tzinfo is None:
+        departure_time = departure_time.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    if departure_time <= now:
+        weeks = (now - departure_time) // timedelta(weeks=1) + 1
+        departure_time += timedelta(weeks=weeks)
+    return departure_time
 
-    for i in range(0, num_addresses, max_rows):
-        origin_addresses = addresses[i:i + max_rows]
 
-        for j in range(0, num_addresses, max_cols):
-            dest_addresses = addresses[j:j + max_cols]
+def existing_overlap(keys, existing):
+    """
+    Cells of an `existing` result that can be reused for the locations with `keys`.
 
-            response = send_request(origin_addresses, dest_addresses)
+    `existing` is {"locations", "distance_matrix", "time_matrix"}, optionally with
+    "rows": the location indices its matrix rows belong to (all when absent).
+    Returns (rows, cols, old_rows, old_cols): the indices of the reusable rows and
+    columns among `keys`, and their row and column positions in the existing matrices.
+    """
+    old_index = {location_key(location): i for i, location in enumerate(existing["locations"])}
+    row_positions = {old: position for position, old in enumerate(existing.get("rows", range(len(old_index))))}
 
-            print(" =======================\n")
-            print(json.dumps(response, indent=2))
-            print(" =======================\n")
+    cols = [i for i, key in enumerate(keys) if key in old_index]
+    old_cols = [old_index[keys[i]] for i in cols]
+    rows = [i for i in cols if old_index[keys[i]] in row_positions]
+    old_rows = [row_positions[old_index[keys[i]]] for i in rows]
+    return rows, cols, old_rows, old_cols
 
-            sub_distance, sub_time = build_matrices(response)
 
-            # Stitch the sub-matrices into correct global indices
-            for oi, (dist_row, time_row) in enumerate(zip(sub_distance, sub_time)):
-                for dj, (dist_val, time_val) in enumerate(zip(dist_row, time_row)):
-                    distance_matrix[i + oi][j + dj] = dist_val
-                    time_matrix[i + oi][j + dj] = time_val
-
-    # ✅ Cache result
-    # with open(CACHE_FILE, "w") as f:
-    #     json.dump({
-    #         "addresses": addresses,
-    #         "distance_matrix": distance_matrix,
-    #         "time_matrix": time_matrix
-    #     }, f, indent=2)
+def _prefill_from_cache(addresses, needed=None, force_refresh=False, existing=None, profile=TRAVEL_MODE):
+    """Creates the matrices filled from an existing matrix and the pair cache,
+    plus the boolean mask of cells still to fetch."""
+    num_addresses = len(addresses)
+    distance_matrix = np.zeros((num_addresses, num_addresses), dtype=np.int32)
+    time_matrix = np.zeros((num_addresses, num_addresses), dtype=np.int32)
+    keys = [location_key(address) for address in addresses]
+
+    key_index = {}
+    for i, key in enumerate(keys):
+        key_index.setdefault(key, []).append(i)
+
+    # Identical locations (and the diagonal) stay at 0
+    same_location = np.zeros((num_addresses, num_addresses), dtype=bool)
+    for rows in key_index.values():
+        same_location[np.ix_(rows, rows)] = True
+    known = same_location.copy()
+
+    # Cells between locations the existing matrix already covers are copied over
+    if existing is not None:
+        rows, cols, old_rows, old_cols = existing_overlap(keys, existing)
+        if rows and cols:
+            old_block = np.ix_(old_rows, old_cols)
+            old_distance = np.asarray(existing["distance_matrix"])[old_block]
+            routable = old_distance < 10**9
+
+            block = np.ix_(rows, cols)
+            distance_matrix[block] = np.where(routable, old_distance, 0)
+            time_matrix[block] = np.where(routable, np.asarray(existing["time_matrix"])[old_block], 0)
+            known[block] |= routable
+
+    # Only look up the pair cache for origins that still have unknown cells
+    if not force_refresh:
+        open_rows = [keys[i] for i in np.flatnonzero(~known.all(axis=1))]
+        cached = matrix_cache.get_many(open_rows, keys, profile) if open_rows else {}
+
+        rows, cols, distances, durations = [], [], [], []
+        for (origin, destination), (distance, duration) in cached.items():
+            for i in key_index[origin]:
+                for j in key_index[destination]:
+                    rows.append(i)
+                    cols.append(j)
+                    distances.append(distance)
+                    durations.append(duration)
+
+        if rows:
+            rows, cols = np.array(rows), np.array(cols)
+            fresh = ~known[rows, cols]
+            rows, cols = rows[fresh], cols[fresh]
+            distance_matrix[rows, cols] = np.array(distances, dtype=np.int32)[fresh]
+            time_matrix[rows, cols] = np.array(durations, dtype=np.int32)[fresh]
+            known[rows, cols] = True
+
+    # Cells the caller does not need get the no-route penalty
+    missing = ~known
+    if needed is not None:
+        unneeded = missing & ~np.asarray(needed, dtype=bool)
+        distance_matrix[unneeded] = 10**9
+        time_matrix[unneeded] = 10**9
+        missing &= ~unneeded
+
+    return distance_matrix, time_matrix, missing, keys, same_location
+
+
+def plan_matrices(addresses, needed=None, force_refresh=False, existing=None, departure_time=None):
+    """Reports the requests create_matrices would send for these addresses, without sending them."""
+    _, _, missing, _, same_location = _prefill_from_cache(addresses, needed, force_refresh, existing,
+                                                          travel_profile(departure_time))
+    tiles = plan_requests(missing)
+    summary = summarize_plan(tiles, missing)
+    summary["locations"] = len(addresses)
+
+    summary["cached_elements"] = _reused_elements(missing, same_location, needed)
+    return summary
+
+
+def _reused_elements(missing, same_location, needed=None) -> int:
+    """Counts wanted cells served without a request (pair cache or existing matrix)."""
+    wanted = ~same_location if needed is None else np.asarray(needed, dtype=bool) & ~same_location
+    return int((wanted & ~missing).sum())
+
+
+def create_matrices(addresses, force_refresh=False, needed=None, existing=None, departure_time=None):
+    """Builds both distance and time matrices for given addresses.
+
+    Cells already present in the pair cache are filled from it and only the
+    missing cells are requested from Google, laid out by `plan_requests` and
+    fetched concurrently (MATRIX_MAX_WORKERS) under the shared Google API limiter.
+    `needed` optionally restricts the fetch to a boolean grid of cells; cells
+    outside it that are not cached get the 10**9 no-route value.
+    `existing` is a previous result ({"locations", "distance_matrix", "time_matrix"},
+    optionally "rows"; see `existing_overlap`); its cells are reused so adding k locations only fetches the k x N + N x k
+    new cells. `departure_time` requests traffic-aware durations; results are
+    cached under that time of day (see `travel_profile`). `force_refresh`
+    ignores the pair cache (fresh values are still written back)."""
+    profile = travel_profile(departure_time)
+    distance_matrix, time_matrix, missing, keys, same_location = _prefill_from_cache(
+        addresses, needed, force_refresh, existing, profile
+    )
+
+    tiles = plan_requests(missing)
+    plan = summarize_plan(tiles, missing)
+    print(f"Distance Matrix plan: {plan}")
+
+    job_size = current_job_size()
+    MATRIX_CACHE_HITS.labels(job_size).inc(_reused_elements(missing, same_location, needed))
+
+    def fetch_tile(tile):
+        rows, cols = tile
+        response = send_request([addresses[r] for r in rows], [addresses[c] for c in cols], departure_time)
+        return build_matrices(response)
+
+    def store_tile(tile, sub_distance, sub_time):
+        rows, cols = tile
+        # Counted once the response is in, so tiles never sent are not reported as billed
+        MATRIX_API_ELEMENTS.labels(job_size).inc(len(rows) * len(cols))
+        block = np.ix_(rows, cols)
+        distance_matrix[block] = sub_distance
+        time_matrix[block] = sub_time
+
+        # Write routable, distinct-location cells back to the pair cache
+        storable = (sub_distance < 10**9) & ~same_location[block]
+        fetched = [
+            (keys[rows[oi]], keys[cols[dj]], int(sub_distance[oi, dj]), int(sub_time[oi, dj]))
+            for oi, dj in zip(*np.nonzero(storable))
+        ]
+        matrix_cache.put_many(fetched, profile)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, settings.MATRIX_MAX_WORKERS))
+    futures = {executor.submit(fetch_tile, tile): tile for tile in tiles}
+    stored = set()
+    try:
+        # Stitch each tile into the global matrices as soon as it arrives
+        for future in as_completed(futures):
+            store_tile(futures[future], *future.result())
+            stored.add(future)
+    except BaseException:
+        # One failed tile fails the whole matrix, so queued tiles are dropped rather than
+        # fetched (with retries) for nothing; tiles that finished still reach the pair cache
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future, tile in futures.items():
+            if future not in stored and future.done() and not future.cancelled() and future.exception() is None:
+                store_tile(tile, *future.result())
+        raise
+    finally:
+        executor.shutdown(wait=True)
 
     return distance_matrix, time_matrix
 
-def send_request(origin_addresses, dest_addresses):
+def send_request(origin_addresses, dest_addresses, departure_time=None):
   """ Build and send request for the given origin and destination addresses."""
   
-  response = gmaps.distance_matrix(origin_addresses,dest_addresses, 'driving', 'imperial')
-  return response
\ No newline at end of file
+  if departure_time is not None:
+    departure_time = _future_departure(departure_time)
+
+  matrix_rate_limiter.acquire(len(origin_addresses) * len(dest_addresses))
+  response = google_api_limiter.call(gmaps.distance_matrix, origin_addresses, dest_addresses,
+                                     mode=TRAVEL_MODE, units='imperial', departure_time=departure_time)
+  return response
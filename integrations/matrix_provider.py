@@ -0,0 +1,148 @@
+import numpy as np
+from core.config import settings
+from integrations.google import route_matrix
+from integrations.google.matrix_cache import location_key
+from integrations.offline import haversine
+
+
+class MatrixProvider:
+    """
+    Source of distance (meters) and time (seconds) matrices between locations.
+
+    Subclasses implement `compute(origins, destinations)` returning
+    [origins x destinations] int32 NumPy distance and time arrays, with 10**9 for
+    pairs that cannot be routed. `create_matrices` builds the square matrices
+    from it, or extends an `existing` result by computing only the rows and
+    columns it does not cover (see `route_matrix.existing_overlap`). The base implementation has no
+    traffic model, so `departure_time` is ignored and the `needed` cell mask
+    is not used to skip work.
+    """
+
+    name = None
+
+    # Whether durations depend on the departure time passed to create_matrices
+    traffic_aware = False
+
+    # Failures the module-level `create_matrices` degrades on to the offline estimate
+    fallback_errors = ()
+
+    def compute(self, origins, destinations):
+        raise NotImplementedError
+
+    def create_matrices(self, locations, existing=None, needed=None, departure_time=None):
+        if existing is None:
+            return self.compute(locations, locations)
+
+        keys = [location_key(location) for location in locations]
+        rows, cols, old_rows, old_cols = route_matrix.existing_overlap(keys, existing)
+
+        num_locations = len(locations)
+        distance_matrix = np.zeros((num_locations, num_locations), dtype=np.int32)
+        time_matrix = np.zeros((num_locations, num_locations), dtype=np.int32)
+
+        if rows and cols:
+            block = np.ix_(rows, cols)
+            distance_matrix[block] = np.asarray(existing["distance_matrix"])[np.ix_(old_rows, old_cols)]
+            time_matrix[block] = np.asarray(existing["time_matrix"])[np.ix_(old_rows, old_cols)]
+
+        # Rows the existing matrices lack are computed in full, the reused rows only for new columns
+        added_rows = sorted(set(range(num_locations)) - set(rows))
+        added_cols = sorted(set(range(num_locations)) - set(cols))
+        if added_rows:
+            distance_matrix[added_rows, :], time_matrix[added_rows, :] = self.compute(
+                [locations[i] for i in added_rows], locations)
+        if rows and added_cols:
+            block = np.ix_(rows, added_cols)
+            distance_matrix[block], time_matrix[block] = self.compute(
+                [locations[i] for i in rows], [locations[j] for j in added_cols])
+
+        return distance_matrix, time_matrix
+
+
+class GoogleMatrixProvider(MatrixProvider):
+    """Distance Matrix API with the pair cache."""
+
+    name = "google"
+    traffic_aware = True
+    fallback_errors = route_matrix.MATRIX_API_ERRORS
+
+    def create_matrices(self, locations, existing=None, needed=None, departure_time=None):
+        return route_matrix.create_matrices(locations, needed=needed, existing=existing,
+                                            departure_time=departure_time)
+
+
+class HaversineMatrixProvider(MatrixProvider):
+    """Network-free straight-line estimate calibrated from cached Google cells."""
+
+    name = "haversine"
+
+    def compute(self, origins, destinations):
+        return haversine.estimate_matrices(origins, destinations)
+
+
+class RoadGraphMatrixProvider(MatrixProvider):
+    """Local many-to-many search on the preprocessed road graph at settings.ROAD_GRAPH_PATH."""
+
+    name = "road_graph"
+
+    def __init__(self):
+        self._graph = None
+
+    @property
+    def graph(self):
+        # Loaded once per process, on first use
+        if self._graph is None:
+            # scipy is only needed when this provider is used
+            from integrations.offline.road_graph import RoadGraph
+
+            if not settings.ROAD_GRAPH_PATH:
+                raise ValueError("ROAD_GRAPH_PATH is not configured")
+            self._graph = RoadGraph.load(settings.ROAD_GRAPH_PATH, settings.ROAD_GRAPH_MAX_SECONDS)
+        return self._graph
+
+    def compute(self, origins, destinations):
+        return self.graph.create_matrices(origins, destinations)
+
+
+_providers = {
+    provider.name: provider
+    for provider in (GoogleMatrixProvider(), HaversineMatrixProvider(), RoadGraphMatrixProvider())
+}
+
+
+def get_matrix_provider(name: str = None) -> MatrixProvider:
+    """Returns the provider registered under `name` (default settings.MATRIX_PROVIDER)."""
+    name = name or settings.MATRIX_PROVIDER
+    try:
+        return _providers[name]
+    except KeyError:
+        raise ValueError(f"Unknown matrix provider: {name}")
+
+
+def register_matrix_provider(provider: MatrixProvider) -> None:
+    """Adds or replaces a provider, keyed by its `name`."""
+    _providers[provider.name] = provider
+
+
+def create_matrices(locations, provider: str = None, existing=None, needed=None, departure_time=None):
+    """Builds distance & time matrices for `locations` with the named provider.
+
+    `existing` is a previous result ({"locations", "distance_matrix", "time_matrix"},
+    optionally "rows") to extend; only cells it does not cover are computed.
+    `needed` optionally marks the cells the caller will read, and
+    `departure_time` asks for durations at that time of day where supported.
+
+    Returns (distance_matrix, time_matrix, estimated). When the provider fails
+    with one of its `fallback_errors` and MATRIX_FALLBACK_TO_ESTIMATE is set, the
+    whole result is the offline estimate instead and `estimated` is True; callers
+    must not keep such matrices as if they came from the provider."""
+    matrix_provider = get_matrix_provider(provider)
+    try:
+        distance_matrix, time_matrix = matrix_provider.create_matrices(locations, existing, needed, departure_time)
+    except matrix_provider.fallback_errors as e:
+        if not settings.MATRIX_FALLBACK_TO_ESTIMATE:
+            raise
+        print(f"Matrix provider {matrix_provider.name} failed ({e}), falling back to offline estimate")
+        distance_matrix, time_matrix = get_matrix_provider("haversine").create_matrices(locations)
+        return distance_matrix, time_matrix, True
+    return distance_matrix, time_matrix, False
@@ -0,0 +1,129 @@
+import numpy as np
+from core.config import settings
+
+EARTH_RADIUS_METERS = 6_371_000.0
+
+# Need at least this many cached Google cells before trusting a calibration
+MIN_CALIBRATION_SAMPLES = 50
+
+_calibration = None
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters; arguments in radians and broadcastable."""
+    h = (np.sin((lat2 - lat1) / 2.0) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine_pairs(origins, destinations) -> np.ndarray:
+    """Great-circle distance in meters between origins[k] and destinations[k] for every k."""
+    origins = np.radians(np.asarray(origins, dtype=np.float64).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=np.float64).reshape(-1, 2))
+    return _haversine(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+
+
+def haversine_matrix(origins, destinations) -> np.ndarray:
+    """Great-circle distances in meters between every origin and destination, in one vectorized pass.
+
+    Uses the identities 1 - cos(a - b) = 1 - (cos a cos b + sin a sin b), so the
+    only per-cell work is outer products plus one sqrt/arcsin."""
+    origins = np.radians(np.asarray(origins, dtype=np.float64).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=np.float64).reshape(-1, 2))
+
+    cos_lat = np.outer(np.cos(origins[:, 0]), np.cos(destinations[:, 0]))
+    cos_dlat = cos_lat + np.outer(np.sin(origins[:, 0]), np.sin(destinations[:, 0]))
+    cos_dlng = (np.outer(np.cos(origins[:, 1]), np.cos(destinations[:, 1]))
+                + np.outer(np.sin(origins[:, 1]), np.sin(destinations[:, 1])))
+
+    h = 0.5 * (1.0 - cos_dlat) + cos_lat * 0.5 * (1.0 - cos_dlng)
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def calibrate(straight_line, road_distance, duration) -> dict:
+    """
+    Fits the estimator to observed Google cells.
+
+    The detour factor is the least-squares slope of road distance over
+    straight-line distance; driving time is fitted as a fixed overhead plus
+    road distance divided by an average speed. Fits that are not physically
+    meaningful (a detour factor below 1, a non-positive time slope, e.g. from a
+    small or noisy sample) are left out, so the configured defaults stay in use.
+    """
+    straight_line = np.asarray(straight_line, dtype=np.float64)
+    road_distance = np.asarray(road_distance, dtype=np.float64)
+    duration = np.asarray(duration, dtype=np.float64)
+
+    fitted = {"samples": int(len(road_distance))}
+
+    detour_factor = float(np.dot(straight_line, road_distance) / np.dot(straight_line, straight_line))
+    if np.isfinite(detour_factor) and detour_factor >= 1.0:
+        fitted["detour_factor"] = detour_factor
+
+    seconds_per_meter, fixed_seconds = np.polyfit(road_distance, duration, 1)
+    if np.isfinite(seconds_per_meter) and seconds_per_meter > 0:
+        fitted["speed_kmh"] = float(3.6 / seconds_per_meter)
+        fitted["fixed_seconds"] = max(0, int(round(fixed_seconds)))
+    return fitted
+
+
+def calibrate_from_cache(cache, profile: str = "driving") -> dict:
+    """Calibrates from cached Distance Matrix cells; keeps the configured defaults if there are too few."""
+    calibration = {
+        "detour_factor": settings.ESTIMATOR_DETOUR_FACTOR,
+        "speed_kmh": settings.ESTIMATOR_SPEED_KMH,
+        "fixed_seconds": settings.ESTIMATOR_FIXED_SECONDS,
+        "samples": 0,
+    }
+
+    cells = cache.sample(profile)
+    if len(cells) < MIN_CALIBRATION_SAMPLES:
+        return calibration
+
+    origins = np.array([cell[0].split(",") for cell in cells], dtype=np.float64)
+    destinations = np.array([cell[1].split(",") for cell in cells], dtype=np.float64)
+    road_distance = np.array([cell[2] for cell in cells], dtype=np.float64)
+    duration = np.array([cell[3] for cell in cells], dtype=np.float64)
+
+    straight_line = haversine_pairs(origins, destinations)
+
+    usable = straight_line > 0
+    if usable.sum() < MIN_CALIBRATION_SAMPLES:
+        return calibration
+
+    calibration.update(calibrate(straight_line[usable], road_distance[usable], duration[usable]))
+    return calibration
+
+
+def get_calibration() -> dict:
+    """Returns the process-wide calibration, computed from the pair cache on first use."""
+    global _calibration
+    if _calibration is None:
+        # Imported lazily so the estimator has no hard dependency on the Google client
+        from integrations.google.route_matrix import matrix_cache, TRAVEL_MODE
+        _calibration = calibrate_from_cache(matrix_cache, TRAVEL_MODE)
+        print(f"Travel-time estimator calibration: {_calibration}")
+    return _calibration
+
+
+def estimate_matrices(origins, destinations=None, calibration=None):
+    """
+    Estimates road distance (m) and driving time (s) matrices without any network call.
+
+    Straight-line distance is scaled by the detour factor; time is the fixed
+    overhead plus road distance at the average speed. Identical points get 0.
+    """
+    if destinations is None:
+        destinations = origins
+    calibration = calibration or get_calibration()
+
+    straight_line = haversine_matrix(origins, destinations)
+    road_distance = straight_line * calibration["detour_factor"]
+    duration = calibration["fixed_seconds"] + road_distance * 3.6 / calibration["speed_kmh"]
+
+    same_point = straight_line < 1.0
+    road_distance[same_point] = 0
+    duration[same_point] = 0
+
+    return np.rint(road_distance).astype(np.int32), np.rint(duration).astype(np.int32)
+
@@ -0,0 +1,95 @@
+import re
+from typing import Optional, Tuple
+
+import numpy as np
+from core.config import settings
+from integrations.google.geocode_cache import _POSTCODE, parse_dutch_address
+
+# Coordinates are stored as fixed-point integers of 1e-7 degree (~1 cm)
+COORDINATE_SCALE = 10**7
+
+# House numbers above this are not stored per address; 0 marks the postcode centroid
+MAX_HOUSE_NUMBER = 99_999
+
+_table = None
+
+
+def postcode_key(postcode: str, house_number: int = 0) -> int:
+    """Packs a PC6 postcode ("2625KT") and house number (0 = centroid) into one sortable integer."""
+    letters = (ord(postcode[4]) - ord("A")) * 26 + ord(postcode[5]) - ord("A")
+    return (int(postcode[:4]) * 676 + letters) * (MAX_HOUSE_NUMBER + 1) + house_number
+
+
+def save_postcode_table(path: str, postcodes, house_numbers, latitudes, longitudes) -> None:
+    """
+    Writes the lookup table read by `PostcodeTable.load` as a single .npy file.
+
+    Each entry is a PC6 postcode with a house number, or house number 0 for the
+    postcode centroid. The table is a (3, N) int64 array of sorted keys and
+    fixed-point latitudes / longitudes, so it can be memory-mapped and searched
+    without loading it.
+    """
+    keys = np.array([postcode_key(pc.upper().replace(" ", ""), int(hn or 0))
+                     for pc, hn in zip(postcodes, house_numbers)], dtype=np.int64)
+    table = np.vstack([
+        keys,
+        np.rint(np.asarray(latitudes, dtype=np.float64) * COORDINATE_SCALE).astype(np.int64),
+        np.rint(np.asarray(longitudes, dtype=np.float64) * COORDINATE_SCALE).astype(np.int64),
+    ])
+    order = np.argsort(keys, kind="stable")
+    np.save(path, np.ascontiguousarray(table[:, order]))
+
+
+class PostcodeTable:
+    """Memory-mapped postcode / house-number coordinate table (see `save_postcode_table`)."""
+
+    def __init__(self, table: np.ndarray):
+        self.keys = table[0]
+        self.latitudes = table[1]
+        self.longitudes = table[2]
+
+    @classmethod
+    def load(cls, path: str) -> "PostcodeTable":
+        return cls(np.load(path, mmap_mode="r"))
+
+    def _find(self, key: int) -> Optional[Tuple[float, float]]:
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return float(self.latitudes[i]) / COORDINATE_SCALE, float(self.longitudes[i]) / COORDINATE_SCALE
+        return None
+
+    def lookup(self, postcode: str, house_number: int = None) -> Optional[Tuple[float, float]]:
+        """(lat, lng) of the address when listed, else the postcode centroid, else None."""
+        if house_number is not None and 0 < house_number <= MAX_HOUSE_NUMBER:
+            location = self._find(postcode_key(postcode, house_number))
+            if location:
+                return location
+        return self._find(postcode_key(postcode))
+
+
+def get_postcode_table() -> Optional[PostcodeTable]:
+    """Returns the process-wide table at settings.POSTCODE_TABLE_PATH, mapped on first use
+    (None when not configured)."""
+    global _table
+    if _table is None and settings.POSTCODE_TABLE_PATH:
+        _table = PostcodeTable.load(settings.POSTCODE_TABLE_PATH)
+        print(f"Loaded postcode table with {len(_table.keys)} entries")
+    return _table
+
+
+def geocode_postcode(address: str) -> Optional[Tuple[float, float]]:
+    """Resolves a Dutch address offline from its postcode (and house number), or None.
+
+    The table is keyed by house number only, so units of one building (the
+    addition) share its coordinates. An address with a number the parser could
+    not split into house number and addition is left to the geocode cache and
+    Google rather than resolved to the postcode centroid."""
+    table = get_postcode_table()
+    if table is None:
+        return None
+    postcode, house_number, _ = parse_dutch_address(address)
+    if postcode is None:
+        return None
+    if house_number is None and re.search(r"\d", _POSTCODE.sub(" ", address.casefold())):
+        return None
+    return table.lookup(postcode, house_number)
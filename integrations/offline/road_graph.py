@@ -0,0 +1,205 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from integrations.offline.haversine import haversine_matrix, haversine_pairs
+
+# Grid cell size (degrees) of the snapping index; ~1 km in the Netherlands
+SNAP_CELL_DEGREES = 0.01
+
+# Straight-line hop from a location to its snapped graph node
+ACCESS_DETOUR_FACTOR = 1.3
+ACCESS_SPEED_MPS = 30 / 3.6
+
+# Sources per Dijkstra batch; bounds the (batch x graph nodes) work arrays
+DIJKSTRA_BATCH = 16
+
+# scipy treats explicit zeros in a sparse graph as missing edges
+MIN_EDGE_WEIGHT = 1e-3
+
+
+def save_road_graph(path: str, node_coords, edge_from, edge_to, length, travel_time) -> None:
+    """
+    Writes a road graph in the compact format read by `RoadGraph.load`.
+
+    `node_coords` is an (M, 2) array of (lat, lng); each directed edge k runs
+    from edge_from[k] to edge_to[k] with `length` in meters and `travel_time`
+    in seconds. Converting an OSM extract (e.g. the Netherlands) amounts to
+    producing these arrays for the drivable ways.
+    """
+    node_coords = np.asarray(node_coords, dtype=np.float32)
+    edge_from = np.asarray(edge_from, dtype=np.int64)
+    edge_to = np.asarray(edge_to, dtype=np.int64)
+    length = np.asarray(length, dtype=np.float32)
+    travel_time = np.asarray(travel_time, dtype=np.float32)
+
+    # Sort by (from, to, time) and keep only the fastest of parallel edges,
+    # since sparse indexing would otherwise sum them
+    order = np.lexsort((travel_time, edge_to, edge_from))
+    edge_from, edge_to = edge_from[order], edge_to[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (edge_from[1:] != edge_from[:-1]) | (edge_to[1:] != edge_to[:-1])
+    order = order[keep]
+    edge_from, edge_to = edge_from[keep], edge_to[keep]
+
+    indptr = np.zeros(len(node_coords) + 1, dtype=np.int64)
+    np.add.at(indptr, edge_from + 1, 1)
+    np.cumsum(indptr, out=indptr)
+
+    np.savez(
+        path,
+        node_coords=node_coords,
+        indptr=indptr,
+        indices=edge_to.astype(np.int32),
+        length=length[order],
+        travel_time=travel_time[order],
+    )
+
+
+class RoadGraph:
+    """
+    Preprocessed directed road graph (CSR arrays) with many-to-many travel-time search.
+
+    Locations are snapped to their nearest graph node through a coarse grid index;
+    matrices are computed with one single-source Dijkstra on travel time per distinct
+    origin (run in batches), bounded to `max_seconds` of driving, and the road
+    distance of each fastest path is summed along the predecessor chains of the
+    destinations only.
+    """
+
+    def __init__(self, node_coords, indptr, indices, length, travel_time, max_seconds: float = np.inf):
+        self.node_coords = np.asarray(node_coords, dtype=np.float64)
+        self.max_seconds = max_seconds
+        num_nodes = len(self.node_coords)
+
+        self.time_graph = csr_matrix(
+            (np.maximum(travel_time, MIN_EDGE_WEIGHT), indices, indptr), shape=(num_nodes, num_nodes)
+        )
+        self.length_graph = csr_matrix(
+            (np.maximum(length, MIN_EDGE_WEIGHT), indices, indptr), shape=(num_nodes, num_nodes)
+        )
+        self.length_graph.sort_indices()
+
+        # Sorted (from * M + to) key of every edge, to look up edge lengths in bulk
+        edge_from = np.repeat(np.arange(num_nodes, dtype=np.int64), np.diff(self.length_graph.indptr))
+        self._edge_keys = edge_from * num_nodes + self.length_graph.indices
+
+        # Snapping index: nodes sorted by grid cell
+        cells = self._cell_ids(self.node_coords)
+        self._snap_order = np.argsort(cells, kind="stable")
+        self._snap_cells = cells[self._snap_order]
+
+    @classmethod
+    def load(cls, path: str, max_seconds: float = np.inf) -> "RoadGraph":
+        with np.load(path) as archive:
+            return cls(archive["node_coords"], archive["indptr"], archive["indices"],
+                       archive["length"], archive["travel_time"], max_seconds)
+
+    @staticmethod
+    def _cell_ids(coords, offset=(0, 0)):
+        lat_cell = np.floor(coords[:, 0] / SNAP_CELL_DEGREES).astype(np.int64) + offset[0]
+        lng_cell = np.floor(coords[:, 1] / SNAP_CELL_DEGREES).astype(np.int64) + offset[1]
+        return lat_cell * 1_000_000 + lng_cell
+
+    def snap(self, locations) -> np.ndarray:
+        """Returns the nearest graph node for every (lat, lng) location."""
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        nearest = np.empty(len(locations), dtype=np.int64)
+
+        for k, location in enumerate(locations):
+            candidates = np.empty(0, dtype=np.int64)
+            radius = 1
+            # Widen the ring of grid cells until at least one node is found
+            while candidates.size == 0 and radius <= 64:
+                offsets = [(dy, dx) for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)]
+                cell_ids = np.array([self._cell_ids(location[None, :], offset)[0] for offset in offsets])
+                starts = np.searchsorted(self._snap_cells, cell_ids, side="left")
+                ends = np.searchsorted(self._snap_cells, cell_ids, side="right")
+                candidates = np.concatenate([self._snap_order[s:e] for s, e in zip(starts, ends)])
+                radius *= 2
+
+            if candidates.size == 0:
+                raise ValueError(f"No road graph node near location {tuple(location)}")
+
+            distances = haversine_matrix(location, self.node_coords[candidates])[0]
+            nearest[k] = candidates[np.argmin(distances)]
+
+        return nearest
+
+    def _edge_lengths(self, edge_from: np.ndarray, edge_to: np.ndarray) -> np.ndarray:
+        """Road length of the edges edge_from[k] -> edge_to[k] (all must exist)."""
+        # int64: scipy's predecessor arrays are int32, too narrow for from * M
+        keys = edge_from.astype(np.int64) * len(self.node_coords) + edge_to
+        return self.length_graph.data[np.searchsorted(self._edge_keys, keys)]
+
+    def _path_lengths(self, predecessors: np.ndarray, destination_nodes: np.ndarray) -> np.ndarray:
+        """
+        Road length from each source of a Dijkstra batch to every destination node.
+
+        Walks all (source, destination) predecessor chains back to their source
+        together, one hop per step, so only nodes on those paths are visited;
+        unreached destinations get 0.
+        """
+        num_sources = predecessors.shape[0]
+        rows = np.repeat(np.arange(num_sources), len(destination_nodes))
+        current = np.tile(destination_nodes, num_sources)
+        lengths = np.zeros(len(current), dtype=np.float64)
+
+        active = np.flatnonzero(predecessors[rows, current] >= 0)
+        while active.size:
+            node = current[active]
+            parent = predecessors[rows[active], node]
+            lengths[active] += self._edge_lengths(parent, node)
+            current[active] = parent
+            active = active[predecessors[rows[active], parent] >= 0]
+        return lengths.reshape(num_sources, len(destination_nodes))
+
+    def many_to_many(self, origin_nodes, destination_nodes):
+        """Travel time (s) and road distance (m) matrices between graph nodes; np.inf when
+        unreachable within `max_seconds`."""
+        origin_nodes = np.asarray(origin_nodes, dtype=np.int64)
+        destination_nodes = np.asarray(destination_nodes, dtype=np.int64)
+
+        # One search per distinct source node
+        sources, source_rows = np.unique(origin_nodes, return_inverse=True)
+        times = np.empty((len(sources), len(destination_nodes)), dtype=np.float64)
+        lengths = np.empty_like(times)
+
+        for start in range(0, len(sources), DIJKSTRA_BATCH):
+            batch = sources[start:start + DIJKSTRA_BATCH]
+            batch_times, predecessors = dijkstra(
+                self.time_graph, directed=True, indices=batch, return_predecessors=True, limit=self.max_seconds
+            )
+            times[start:start + len(batch)] = batch_times[:, destination_nodes]
+            lengths[start:start + len(batch)] = self._path_lengths(predecessors, destination_nodes)
+
+        lengths[~np.isfinite(times)] = np.inf
+        return times[source_rows], lengths[source_rows]
+
+    def create_matrices(self, origins, destinations=None):
+        """Distance (m) and time (s) integer matrices between (lat, lng) locations; 10**9 when unroutable."""
+        if destinations is None:
+            destinations = origins
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+
+        origin_nodes = self.snap(origins)
+        destination_nodes = self.snap(destinations)
+        times, lengths = self.many_to_many(origin_nodes, destination_nodes)
+
+        # Add the hop between each location and its snapped node at both ends
+        origin_access = haversine_pairs(origins, self.node_coords[origin_nodes]) * ACCESS_DETOUR_FACTOR
+        destination_access = haversine_pairs(destinations, self.node_coords[destination_nodes]) * ACCESS_DETOUR_FACTOR
+        access = origin_access[:, None] + destination_access[None, :]
+        lengths += access
+        times += access / ACCESS_SPEED_MPS
+
+        # Identical locations cost nothing
+        same_point = haversine_matrix(origins, destinations) < 1.0
+        lengths[same_point] = 0
+        times[same_point] = 0
+
+        unroutable = ~np.isfinite(times)
+        distance_matrix = np.where(unroutable, 10**9, np.minimum(np.rint(lengths), 10**9)).astype(np.int32)
+        time_matrix = np.where(unroutable, 10**9, np.minimum(np.rint(times), 10**9)).astype(np.int32)
+        return distance_matrix, time_matrix
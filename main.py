@@ -1,8 +1,24 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from api.v1.router import api_router
+from integrations.google.geocoding import geocoding_client
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release the geocoding client's pooled connections
+    await geocoding_client.close()
 
 
-app.include_router(api_router, prefix="/api/v1")
\ No newline at end of file
+app = FastAPI(lifespan=lifespan)
+
+
+app.include_router(api_router, prefix="/api/v1")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint: per-phase timings, matrix elements, cache hits and solver results."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
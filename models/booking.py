@@ -26,6 +26,9 @@ class Booking(BaseModel):
     # The number of passengers.
     passengers: int
 
+    # The number of wheelchairs; each takes up two seats in the vehicle.
+    wheelchairs: int = 0
+
     # The pickup time, parsed as a Python datetime object.
     pickup_time: datetime = Field(..., alias="pickupTime")
 
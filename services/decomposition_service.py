@@ -0,0 +1,319 @@
+import bisect
+import math
+import time
+from typing import List
+
+import numpy as np
+from core.config import settings
+from integrations.matrix_provider import create_matrices
+from models.booking import Booking
+from models.vehicle import VehicleModel
+from services.optimization_service import (
+    DROPPED_BOOKING_PENALTY, PORTFOLIO_CONFIGS, SERVICE_TIME_SECONDS, WHEELCHAIR_SEATS,
+    day_matrices, day_matrices_key, prepare_locations, create_data_model, solve_time_budget, solve_with_config,
+    solver_executor, solver_workers,
+)
+from utils.common import datetime_to_seconds
+
+
+def partition_bookings(bookings: List[Booking], max_bookings: int) -> List[List[List[Booking]]]:
+    """
+    Splits bookings into sub-problems of at most `max_bookings`, grouped by time band.
+
+    Bookings are first cut into equal time bands by pickup time; each band is then
+    swept by the angle of its pickups around the band's centre into geographic
+    sectors. Roughly sqrt(parts) sectors are used per band.
+    """
+    num_parts = math.ceil(len(bookings) / max_bookings)
+    sectors_per_band = max(1, round(math.sqrt(num_parts)))
+    num_bands = math.ceil(num_parts / sectors_per_band)
+
+    by_time = sorted(bookings, key=lambda booking: booking.pickup_time)
+    band_size = math.ceil(len(by_time) / num_bands)
+
+    bands = []
+    for start in range(0, len(by_time), band_size):
+        band = by_time[start:start + band_size]
+        centre_lat = np.mean([booking.pickup.latitude for booking in band])
+        centre_lng = np.mean([booking.pickup.longitude for booking in band])
+        by_angle = sorted(band, key=lambda booking: math.atan2(booking.pickup.latitude - centre_lat,
+                                                               booking.pickup.longitude - centre_lng))
+        num_sectors = math.ceil(len(band) / max_bookings)
+        sector_size = math.ceil(len(band) / num_sectors)
+        bands.append([by_angle[i:i + sector_size] for i in range(0, len(by_angle), sector_size)])
+    return bands
+
+
+def fleet_shares(sectors: List[List[Booking]], vehicles: List[VehicleModel]) -> List[List[VehicleModel]]:
+    """
+    Splits the fleet over the sectors of one time band, proportional to their bookings.
+
+    Every sector gets at least one vehicle; when there are more sectors than
+    vehicles, vehicles are shared and the stitching pass resolves the overlap.
+    """
+    fleet = sorted(vehicles, key=lambda vehicle: vehicle.total_seats, reverse=True)
+    total = sum(len(sector) for sector in sectors)
+    exact = [len(fleet) * len(sector) / total for sector in sectors]
+    counts = [max(1, int(share)) for share in exact]
+
+    # Largest remainders get the vehicles left over
+    for i in sorted(range(len(sectors)), key=lambda i: exact[i] - int(exact[i]), reverse=True):
+        if sum(counts) >= len(fleet):
+            break
+        counts[i] += 1
+
+    shares, offset = [], 0
+    for count in counts:
+        shares.append([fleet[(offset + k) % len(fleet)] for k in range(count)])
+        offset += count
+    return shares
+
+
+def _route_summaries(result: dict, bookings_by_id: dict) -> list:
+    """Start/end time, end locations and peak effective load of every route in a sub-problem result."""
+    routes = []
+    for cluster in result["clusters"]:
+        stops = [stop for stop in cluster["path"] if stop.get("booking_id")]
+        if not stops:
+            continue
+
+        load = peak_load = 0
+        for stop in stops:
+            booking = bookings_by_id[stop["booking_id"]]
+            demand = booking.passengers + WHEELCHAIR_SEATS * booking.wheelchairs
+            load += demand if stop["type"] == "Pickup" else -demand
+            peak_load = max(peak_load, load)
+
+        def location(stop):
+            booking = bookings_by_id[stop["booking_id"]]
+            point = booking.pickup if stop["type"] == "Pickup" else booking.delivery
+            return point.latitude, point.longitude
+
+        routes.append({
+            "cluster": cluster,
+            "start": datetime_to_seconds(stops[0]["arrival_time"]),
+            "end": datetime_to_seconds(stops[-1]["arrival_time"]),
+            "first_location": location(stops[0]),
+            "last_location": location(stops[-1]),
+            "peak_load": peak_load,
+        })
+    return routes
+
+
+def transfer_times(routes: list, matrix_provider=None) -> dict:
+    """
+    Driving time from the last stop of every route to the first stop of every route,
+    from the matrix provider the sub-problems were solved with.
+
+    Returns {(last_location, first_location): seconds}; unroutable pairs are 10**9
+    and never fit.
+    """
+    last_locations = list(dict.fromkeys(route["last_location"] for route in routes))
+    first_locations = list(dict.fromkeys(route["first_location"] for route in routes))
+    points = list(dict.fromkeys(last_locations + first_locations))
+    index = {point: i for i, point in enumerate(points)}
+
+    # Only the last -> first cells are read
+    needed = np.zeros((len(points), len(points)), dtype=bool)
+    needed[np.ix_([index[point] for point in last_locations], [index[point] for point in first_locations])] = True
+    np.fill_diagonal(needed, False)
+    _, duration, _ = create_matrices(points, matrix_provider, needed=needed)
+
+    return {(origin, destination): int(duration[index[origin], index[destination]])
+            for origin in last_locations for destination in first_locations}
+
+
+def _fits(vehicle_routes: list, route: dict, transfers: dict) -> bool:
+    """Whether `route` fits between the vehicle's existing routes (sorted by start), including transfers."""
+    position = bisect.bisect([existing["start"] for existing in vehicle_routes], route["start"])
+    if position > 0:
+        previous = vehicle_routes[position - 1]
+        if previous["end"] + SERVICE_TIME_SECONDS \
+                + transfers[previous["last_location"], route["first_location"]] > route["start"]:
+            return False
+    if position < len(vehicle_routes):
+        following = vehicle_routes[position]
+        if route["end"] + SERVICE_TIME_SECONDS \
+                + transfers[route["last_location"], following["first_location"]] > following["start"]:
+            return False
+    return True
+
+
+def stitch_routes(routes: list, vehicles: List[VehicleModel], fleet_state: list, matrix_provider=None) -> list:
+    """
+    Assigns sub-problem routes to real vehicles, in order of their first stop.
+
+    A vehicle can take a route if it has the seats for the route's peak load and
+    the route fits in its schedule: after the previous route and before the next
+    one, with travel (`transfer_times`) plus service in between. Among those
+    vehicles the one with the least idle time before the route is used, keeping
+    longer gaps free. Updates `fleet_state` in place and returns the routes no
+    vehicle could take.
+    """
+    if not routes:
+        return []
+    placed = [existing for state in fleet_state for existing in state["routes"]]
+    transfers = transfer_times(placed + routes, matrix_provider)
+
+    unplaced = []
+    for route in sorted(routes, key=lambda route: route["start"]):
+        best = None
+        for i, vehicle in enumerate(vehicles):
+            if vehicle.total_seats < route["peak_load"] or not _fits(fleet_state[i]["routes"], route, transfers):
+                continue
+            earlier = [existing["end"] for existing in fleet_state[i]["routes"] if existing["end"] <= route["start"]]
+            idle_since = max(earlier) if earlier else -1
+            if best is None or idle_since > best[0]:
+                best = (idle_since, i)
+
+        if best is None:
+            unplaced.append(route)
+            continue
+
+        vehicle_routes = fleet_state[best[1]]["routes"]
+        vehicle_routes.insert(bisect.bisect([existing["start"] for existing in vehicle_routes], route["start"]),
+                              route)
+    return unplaced
+
+
+def _split_route(route: dict, bookings_by_id: dict) -> list:
+    """Breaks a route into one route per booking (its pickup and dropoff stops)."""
+    path = route["cluster"]["path"]
+    clusters = []
+    for booking in route["cluster"]["bookings"]:
+        stops = [stop for stop in path if stop.get("booking_id") == booking["booking_id"]]
+        clusters.append({"vehicle_id": route["cluster"]["vehicle_id"], "bookings": [booking],
+                         "path": [path[0], *stops, path[-1]]})
+    return _route_summaries({"clusters": clusters}, bookings_by_id)
+
+
+def _merge_clusters(vehicles: List[VehicleModel], fleet_state: list, global_nodes: dict) -> list:
+    """One cluster per real vehicle: its routes' stops in order, node indices of the full problem."""
+    clusters = []
+    for vehicle, state in zip(vehicles, fleet_state):
+        if not state["routes"]:
+            continue
+        first_path = state["routes"][0]["cluster"]["path"]
+        last_path = state["routes"][-1]["cluster"]["path"]
+
+        path = [dict(first_path[0], node_index=0)]
+        bookings = []
+        for route in state["routes"]:
+            for stop in route["cluster"]["path"]:
+                if stop.get("booking_id"):
+                    path.append(dict(stop, node_index=global_nodes[(stop["booking_id"], stop["type"])]))
+            bookings.extend(route["cluster"]["bookings"])
+        path.append(dict(last_path[-1], node_index=0))
+
+        clusters.append({"vehicle_id": str(vehicle.id), "bookings": bookings, "path": path})
+    return clusters
+
+
+def optimize_decomposed(bookings_data: List[Booking], vehicles: List[VehicleModel], matrix_provider=None,
+                        existing_matrices=None, time_limit: float = None, deadline=None) -> dict:
+    """
+    Plans a large booking set as parallel sub-problems.
+
+    Bookings are partitioned by time band and geography (`partition_bookings`),
+    each part gets a share of the fleet within its band (`fleet_shares`). Parts
+    are built one after another in this process and each is handed to the solver
+    worker processes as soon as its data is ready, so solves run while later
+    parts are still being built; build time counts against the time limit or
+    deadline. The sub-routes are stitched onto real vehicles (`stitch_routes`);
+    bookings dropped by a part or on routes no vehicle could take are re-solved
+    together with the whole fleet in a repair pass, stitched into the remaining
+    gaps, and what still does not fit is tried once more booking by booking.
+
+    Returns the `extract_solution` format. The reported objective is the routing
+    cost of every sub-problem and repair solve plus DROPPED_BOOKING_PENALTY per
+    booking left unserved; it is not comparable to the objective of one whole solve.
+    """
+    max_bookings = settings.DECOMPOSITION_MAX_BOOKINGS
+    bands = partition_bookings(bookings_data, max_bookings)
+    parts = [sector for band in bands for sector in band]
+    shares = [share for band in bands for share in fleet_shares(band, vehicles)]
+    print(f"Decomposed {len(bookings_data)} bookings into {len(parts)} sub-problems: {[len(p) for p in parts]}")
+
+    # Parts only read the day's stored matrices; each covers a fraction of the locations, so none is stored back
+    existing_matrices = existing_matrices or day_matrices.get(day_matrices_key(bookings_data, matrix_provider))
+
+    # With a time limit or deadline, the whole plan must be ready by `finish`
+    finish = None
+    if time_limit is not None or deadline is not None:
+        finish = time.monotonic() + solve_time_budget(0, 0, time_limit, deadline)
+    workers = solver_workers()
+    # Set once any part was planned on offline estimates of a failed matrix provider
+    estimated = []
+
+    def submit(part, fleet, rounds_left):
+        locations, _, node_locations = prepare_locations(part)
+        data = create_data_model(part, locations, fleet, node_locations, matrix_provider, existing_matrices)
+        if data["estimated_matrices"]:
+            estimated.append(True)
+        worker_data = {key: value for key, value in data.items() if key != "location_matrices"}
+        sub_time_limit = None
+        if finish is not None:
+            # What is left after building, split over the rounds of parallel solves still to come
+            sub_time_limit = max(0.0, finish - time.monotonic()) / rounds_left
+        solve_seconds = solve_time_budget(len(node_locations), len(fleet), sub_time_limit)
+        return solver_executor().submit(solve_with_config, worker_data, PORTFOLIO_CONFIGS[0], solve_seconds)
+
+    def routing_cost(result):
+        return result["objective"] - DROPPED_BOOKING_PENALTY * len(result["solution"]["dropped_bookings"])
+
+    bookings_by_id = {booking.id: booking for booking in bookings_data}
+    # Part k solves in round k // workers, followed by the repair round
+    futures = [submit(part, fleet, math.ceil((len(parts) - k) / workers) + 1)
+               for k, (part, fleet) in enumerate(zip(parts, shares))]
+
+    routes, dropped, objective = [], [], 0
+    for future in futures:
+        result = future.result()
+        if result["solution"] is None:
+            print(f"Sub-problem {result['config']} found no solution")
+            continue
+        objective += routing_cost(result)
+        routes.extend(_route_summaries(result["solution"], bookings_by_id))
+        dropped.extend(result["solution"]["dropped_bookings"])
+    # Bookings of parts that found no solution at all
+    covered = set(dropped) | {booking["booking_id"] for route in routes for booking in route["cluster"]["bookings"]}
+    dropped.extend(booking.id for booking in bookings_data if booking.id not in covered)
+
+    fleet_state = [{"routes": []} for _ in vehicles]
+    unplaced = stitch_routes(routes, vehicles, fleet_state, matrix_provider)
+    dropped.extend(booking["booking_id"] for route in unplaced for booking in route["cluster"]["bookings"])
+
+    # Repair pass: re-solve everything left over with the whole fleet and stitch it into the gaps
+    if dropped:
+        print(f"Repairing {len(dropped)} dropped bookings")
+        repair_parts = [part for band in partition_bookings([bookings_by_id[booking_id] for booking_id in dropped],
+                                                            max_bookings) for part in band]
+        futures = [submit(part, vehicles, math.ceil((len(repair_parts) - k) / workers))
+                   for k, part in enumerate(repair_parts)]
+        repair_routes = []
+        for future in futures:
+            result = future.result()
+            if result["solution"] is not None:
+                objective += routing_cost(result)
+                repair_routes.extend(_route_summaries(result["solution"], bookings_by_id))
+        unplaced = stitch_routes(repair_routes, vehicles, fleet_state, matrix_provider)
+        # Whatever still does not fit is tried booking by booking in the remaining gaps
+        stitch_routes([single for route in unplaced for single in _split_route(route, bookings_by_id)],
+                      vehicles, fleet_state, matrix_provider)
+        placed = {booking["booking_id"] for state in fleet_state for route in state["routes"]
+                  for booking in route["cluster"]["bookings"]}
+        dropped = [booking_id for booking_id in dropped if booking_id not in placed]
+
+    # Node indices of the full problem: pickup 2k+1, delivery 2k+2 for booking k
+    global_nodes = {}
+    for k, booking in enumerate(bookings_data):
+        global_nodes[(booking.id, "Pickup")] = 2 * k + 1
+        global_nodes[(booking.id, "Dropoff")] = 2 * k + 2
+
+    order = {booking.id: k for k, booking in enumerate(bookings_data)}
+    return {
+        "clusters": _merge_clusters(vehicles, fleet_state, global_nodes),
+        "dropped_bookings": sorted(set(dropped), key=order.get),
+        "solver": {"config": PORTFOLIO_CONFIGS[0], "objective": objective + DROPPED_BOOKING_PENALTY * len(set(dropped)),
+                   "sub_problems": len(parts), "estimated_matrices": bool(estimated)},
+    }
@@ -0,0 +1,209 @@
+from typing import List, Optional
+
+from models.booking import Booking
+from models.vehicle import VehicleModel
+from core.metrics import track_phase
+from services.optimization_service import (
+    SERVICE_TIME_SECONDS, day_matrices, day_matrices_key, prepare_locations, create_data_model, initial_routes,
+    matrix_rows,
+)
+from utils.common import seconds_to_iso_string
+
+
+def arrival_times(data, route: list) -> list:
+    """
+    Earliest arrival at every stop of a route (node indices, depots excluded).
+
+    Follows the solver's time model: the vehicle leaves the depot when its
+    window opens, service time is added on arrival at a stop, and waiting for a
+    window to open is allowed. Returns [start, *arrivals, end].
+    """
+    time_matrix, windows, depot = data["time_matrix"], data["time_windows"], data["depot"]
+
+    now = windows[depot][0]
+    times = [now]
+    previous = depot
+    for node in route:
+        now = max(windows[node][0], now + time_matrix[previous][node] + SERVICE_TIME_SECONDS)
+        times.append(now)
+        previous = node
+    times.append(now + time_matrix[previous][depot])
+    return times
+
+
+def route_schedule(data, route: list, capacity: int) -> Optional[list]:
+    """`arrival_times` of a route, or None when it misses a time window or exceeds the
+    vehicle's effective seats."""
+    times = arrival_times(data, route)
+    windows, demands = data["time_windows"], data["capacity_demands"]
+    if times[-1] > windows[data["depot"]][1]:
+        return None
+
+    load = 0
+    for node, arrival in zip(route, times[1:-1]):
+        load += demands[node]
+        if arrival > windows[node][1] or load > capacity:
+            return None
+    return times
+
+
+def added_travel(matrix, stops: list, pickup: int, delivery: int, i: int, j: int) -> int:
+    """Increase in the summed `matrix` legs of `stops` (depots included) when the pickup goes
+    after stop i and the delivery after stop j (j >= i, both counted before the pickup)."""
+    before, after = stops[i], stops[i + 1]
+    if i == j:
+        return matrix[before][pickup] + matrix[pickup][delivery] + matrix[delivery][after] - matrix[before][after]
+    before_delivery, after_delivery = stops[j], stops[j + 1]
+    return matrix[before][pickup] + matrix[pickup][after] - matrix[before][after] \
+        + matrix[before_delivery][delivery] + matrix[delivery][after_delivery] \
+        - matrix[before_delivery][after_delivery]
+
+
+def cheapest_insertion(data, routes: list, pickup: int, delivery: int) -> Optional[dict]:
+    """
+    Finds the cheapest feasible position for one pickup/delivery pair over all routes.
+
+    Every vehicle and every pickup position before every delivery position is
+    priced by added distance (the solver's arc cost); candidates are then checked
+    for feasibility cheapest first, so usually only a few schedules are computed.
+    Returns {"vehicle", "route", "schedule", "added_distance", "added_duration"},
+    or None when the pair fits nowhere. "added_duration" is the added driving
+    time in seconds (service and waiting time excluded), priced like the distance.
+    """
+    distance, time = data["distance_matrix"], data["time_matrix"]
+    depot = data["depot"]
+
+    candidates = []
+    for vehicle, route in enumerate(routes):
+        stops = [depot, *route, depot]
+        for i in range(len(route) + 1):
+            before, after = stops[i], stops[i + 1]
+            # Delivery right after the pickup
+            cost = distance[before][pickup] + distance[pickup][delivery] + distance[delivery][after] \
+                - distance[before][after]
+            candidates.append((cost, vehicle, i, i))
+
+            pickup_cost = distance[before][pickup] + distance[pickup][after] - distance[before][after]
+            for j in range(i + 1, len(route) + 1):
+                before_delivery, after_delivery = stops[j], stops[j + 1]
+                cost = pickup_cost + distance[before_delivery][delivery] + distance[delivery][after_delivery] \
+                    - distance[before_delivery][after_delivery]
+                candidates.append((cost, vehicle, i, j))
+
+    candidates.sort(key=lambda candidate: candidate[0])
+    for cost, vehicle, i, j in candidates:
+        route = routes[vehicle]
+        new_route = [*route[:i], pickup, *route[i:j], delivery, *route[j:]]
+        schedule = route_schedule(data, new_route, data["capacities"][vehicle])
+        if schedule is None:
+            continue
+        return {
+            "vehicle": vehicle,
+            "route": new_route,
+            "schedule": schedule,
+            "added_distance": int(cost),
+            "added_duration": int(added_travel(time, [depot, *route, depot], pickup, delivery, i, j)),
+        }
+    return None
+
+
+def insert_bookings(bookings: List[Booking], vehicles: List[VehicleModel], clusters: list,
+                    new_bookings: List[Booking], matrix_provider=None, existing_matrices=None) -> dict:
+    """
+    Adds new bookings to an existing plan by cheapest feasible insertion, without re-solving.
+
+    `clusters` is the plan (the `clusters` of an earlier result) for `bookings`.
+    New bookings are inserted one at a time, earliest pickup first, each at the
+    position that adds the least distance while keeping every time window and
+    seat capacity on its route; the rest of the plan keeps its order. A new
+    booking with the id of a planned one replaces it. The location matrices of
+    the day (`existing_matrices`, else those kept in `day_matrices` by the run
+    that planned it) are extended, so only the rows and columns of new
+    locations are computed; the result is kept for the next insertion.
+
+    Returns the `extract_solution` format for the updated plan (node indices of
+    `bookings` followed by `new_bookings`) plus "insertions", one entry per
+    inserted booking.
+    """
+    new_ids = {booking.id for booking in new_bookings}
+    all_bookings = [booking for booking in bookings if booking.id not in new_ids] + list(new_bookings)
+
+    locations, _, node_locations = prepare_locations(all_bookings)
+    store_key = day_matrices_key(all_bookings, matrix_provider)
+    data = create_data_model(all_bookings, locations, vehicles, node_locations, matrix_provider,
+                             existing_matrices or day_matrices.get(store_key))
+    if not data["estimated_matrices"]:
+        day_matrices.put(store_key, data["location_matrices"])
+
+    with track_phase("insertion"):
+        # Replaced bookings leave their old stops
+        new_nodes = {node for (pickup, delivery), booking in zip(data["pickups_deliveries"], all_bookings)
+                     if booking.id in new_ids for node in (pickup, delivery)}
+        routes = [[node for node in route if node not in new_nodes] for route in initial_routes(data, clusters)]
+        # Convert once: element access on NumPy arrays is slow in the insertion loops
+        data = dict(data, distance_matrix=matrix_rows(data["distance_matrix"]),
+                    time_matrix=matrix_rows(data["time_matrix"]))
+
+        for vehicle, route in enumerate(routes):
+            if route and route_schedule(data, route, data["capacities"][vehicle]) is None:
+                print(f"Planned route of vehicle {vehicle} is infeasible for the current matrices")
+
+        pairs = [(pair, booking) for pair, booking in zip(data["pickups_deliveries"], all_bookings)
+                 if booking.id in new_ids]
+        insertions = []
+        for (pickup, delivery), booking in sorted(pairs, key=lambda pair: pair[1].pickup_time):
+            insertion = cheapest_insertion(data, routes, pickup, delivery)
+            if insertion is None:
+                print(f"No feasible insertion for booking {booking.id}")
+                continue
+            routes[insertion["vehicle"]] = insertion["route"]
+            insertions.append({
+                "booking_id": booking.id,
+                "vehicle_id": str(vehicles[insertion["vehicle"]].id),
+                "added_distance": insertion["added_distance"],
+                "added_duration": insertion["added_duration"],
+            })
+            print(f"Inserted booking {booking.id} on vehicle {insertion['vehicle']}: "
+                  f"+{insertion['added_distance']} m, +{insertion['added_duration']} s")
+
+        result = routes_to_solution(data, routes)
+    result["insertions"] = insertions
+    return result
+
+
+def routes_to_solution(data, routes: list) -> dict:
+    """Formats node routes like `extract_solution`, with earliest arrival times as the schedule."""
+    node_mapping = {}
+    for (pickup, delivery), booking in zip(data["pickups_deliveries"], data["bookings"]):
+        node_mapping[pickup] = ("Pickup", booking)
+        node_mapping[delivery] = ("Dropoff", booking)
+
+    clusters = []
+    assigned = set()
+    for vehicle, route in enumerate(routes):
+        if not route:
+            continue
+        # Planned routes that no longer fit are kept as they were, with their earliest times
+        schedule = arrival_times(data, route)
+
+        path = [{"node_index": data["depot"], "arrival_time": seconds_to_iso_string(schedule[0])}]
+        bookings_in_route = {}
+        for node, arrival in zip(route, schedule[1:-1]):
+            label, booking = node_mapping[node]
+            arrival_time = seconds_to_iso_string(arrival)
+            path.append({"node_index": node, "arrival_time": arrival_time, "type": label, "booking_id": booking.id})
+            entry = bookings_in_route.setdefault(booking.id, {"booking_id": booking.id})
+            entry["pickup_time" if label == "Pickup" else "dropoff_time"] = arrival_time
+            assigned.add(booking.id)
+        path.append({"node_index": data["depot"], "arrival_time": seconds_to_iso_string(schedule[-1])})
+
+        clusters.append({
+            "vehicle_id": str(data["vehicles"][vehicle].id),
+            "bookings": list(bookings_in_route.values()),
+            "path": path,
+        })
+
+    return {
+        "clusters": clusters,
+        "dropped_bookings": [booking.id for booking in data["bookings"] if booking.id not in assigned],
+    }
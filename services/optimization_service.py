@@ -1,32 +1,255 @@
 import asyncio
+import contextlib
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
 from models.booking import Booking, Coordinates
 from models.vehicle import VehicleModel
-from integrations.google.route_matrix import create_matrices
+from integrations.google.route_matrix import plan_matrices
+from integrations.matrix_provider import create_matrices, get_matrix_provider
+from integrations.google.matrix_cache import location_key
 from integrations.google.geocoding import geocode_address_async
+from integrations.offline.haversine import haversine_matrix
 from typing import Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone, time as dt_time
+from core.config import settings
+from core.metrics import (
+    job_size, current_job_size, track_phase, observe_phase,
+    SOLVER_OBJECTIVE, DROPPED_BOOKINGS, OPTIMIZATION_JOBS,
+)
 from fastapi import HTTPException
 
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
 from utils.common import to_dict, seconds_to_iso_string
+from utils.lru_cache import LruCache
+
+# Time spent at every pickup / delivery stop
+SERVICE_TIME_SECONDS = 300
+
+# Seats a wheelchair takes up in a vehicle
+WHEELCHAIR_SEATS = 2
+
+# Origin rows per block of the `feasible_arcs` pre-pass, bounding its temporaries
+FEASIBILITY_BLOCK_ROWS = 256
+
+# Objective cost of leaving a booking unserved; high to strongly prefer serving all
+DROPPED_BOOKING_PENALTY = 100000000
+
+# Search configurations, in the order the portfolio takes them (SOLVER_PORTFOLIO_SIZE);
+# the routing library has no random seed, so variants differ in the guided local search penalty factor
+PORTFOLIO_CONFIGS = [
+    {"first_solution_strategy": "PATH_CHEAPEST_ARC", "metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION", "metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "LOCAL_CHEAPEST_INSERTION", "metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "PATH_CHEAPEST_ARC", "metaheuristic": "SIMULATED_ANNEALING"},
+    {"first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION", "metaheuristic": "TABU_SEARCH"},
+    {"first_solution_strategy": "PATH_CHEAPEST_ARC", "metaheuristic": "GUIDED_LOCAL_SEARCH", "gls_lambda": 0.3},
+    {"first_solution_strategy": "GLOBAL_CHEAPEST_ARC", "metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION", "metaheuristic": "GUIDED_LOCAL_SEARCH",
+     "gls_lambda": 0.05},
+    {"first_solution_strategy": "LOCAL_CHEAPEST_INSERTION", "metaheuristic": "SIMULATED_ANNEALING"},
+    {"first_solution_strategy": "PATH_MOST_CONSTRAINED_ARC", "metaheuristic": "GUIDED_LOCAL_SEARCH"},
+    {"first_solution_strategy": "SEQUENTIAL_CHEAPEST_INSERTION", "metaheuristic": "TABU_SEARCH"},
+    {"first_solution_strategy": "LOCAL_CHEAPEST_INSERTION", "metaheuristic": "GUIDED_LOCAL_SEARCH",
+     "gls_lambda": 0.3},
+]
+
+_portfolio_pool = None
+_portfolio_pool_lock = threading.Lock()
+
+# Latest `location_matrices` per matrix provider and service date, extended by later requests of that day
+day_matrices = LruCache(settings.MATRIX_STORE_DAYS)
+
+def booking_time_windows(booking: Booking):
+    """Returns ((pickup_start, pickup_end), (delivery_start, delivery_end)) in seconds of day."""
+    # Convert pickup and delivery times to seconds
+    pickup_time = (booking.pickup_time.hour * 3600) + (booking.pickup_time.minute * 60) + booking.pickup_time.second
+    delivery_time = (booking.delivery_time.hour * 3600) + (booking.delivery_time.minute * 60) + booking.delivery_time.second
+
+    # pickup window ±25 mins, delivery window up to +25 mins
+    return (pickup_time - 1500, pickup_time + 1500), (delivery_time, delivery_time + 1500)
+
+def departure_bucket(seconds_of_day: int):
+    """Departure-time bucket of a node, or None when bucketing is disabled."""
+    if not settings.TIME_BUCKET_SECONDS:
+        return None
+    return max(0, int(seconds_of_day)) // settings.TIME_BUCKET_SECONDS
+
+def node_departure_buckets(bookings: List[Booking], matrix_provider=None) -> list:
+    """Departure bucket of every solver node (depot first, then pickup/delivery per booking).
+
+    A node departs roughly at the start of its time window; the depot takes the
+    bucket of the earliest window. All None for providers without a traffic model."""
+    if not get_matrix_provider(matrix_provider).traffic_aware:
+        return [None] * (2 * len(bookings) + 1)
+
+    departures = []
+    for booking in bookings:
+        (pickup_start, _), (delivery_start, _) = booking_time_windows(booking)
+        departures += [pickup_start, delivery_start]
+    departures.insert(0, min(departures) if departures else 0)
+    return [departure_bucket(departure) for departure in departures]
+
+def feasible_arcs(bookings: List[Booking], locations, node_locations) -> np.ndarray:
+    """Boolean [node x node] mask of arcs that can appear in a route.
+
+    Arc i -> j is kept only if leaving i at the start of its window and driving
+    the straight-line distance at FEASIBILITY_MAX_SPEED_KMH (a lower bound on
+    the real travel time) still reaches j, serviced, before its window closes.
+    A booking's delivery never precedes its own pickup; depot arcs are always kept.
+    Computed in blocks of FEASIBILITY_BLOCK_ROWS origin rows, so only the mask
+    itself is [node x node]."""
+    num_nodes = len(node_locations)
+    starts = np.zeros(num_nodes, dtype=np.int64)
+    ends = np.zeros(num_nodes, dtype=np.int64)
+    for i, booking in enumerate(bookings, start=1):
+        (starts[2 * i - 1], ends[2 * i - 1]), (starts[2 * i], ends[2 * i]) = booking_time_windows(booking)
+
+    points = np.asarray(locations, dtype=np.float64).reshape(-1, 2)[np.asarray(node_locations)]
+    # Latest departure from i that still reaches j, before the travel time
+    latest = (ends - SERVICE_TIME_SECONDS).astype(np.int32)
+    starts = starts.astype(np.int32)
+    seconds_per_meter = 3.6 / settings.FEASIBILITY_MAX_SPEED_KMH
+
+    arcs = np.empty((num_nodes, num_nodes), dtype=bool)
+    for start in range(0, num_nodes, FEASIBILITY_BLOCK_ROWS):
+        block = slice(start, start + FEASIBILITY_BLOCK_ROWS)
+        # Whole seconds, rounded down so the bound never rules out a reachable arc
+        travel_lower_bound = np.floor(haversine_matrix(points[block], points) * seconds_per_meter).astype(np.int32)
+        travel_lower_bound += starts[block, None]
+        arcs[block] = travel_lower_bound <= latest[None, :]
+
+    deliveries = np.arange(2, num_nodes, 2)
+    arcs[deliveries, deliveries - 1] = False
+    arcs[0, :] = True
+    arcs[:, 0] = True
+    np.fill_diagonal(arcs, False)
+    return arcs
+
+def bucket_requests(bookings: List[Booking], locations, node_locations, node_buckets):
+    """Yields the per-bucket matrix requests as (bucket, needed, departure_time).
+
+    A bucket only needs the location cells of arcs leaving nodes that depart in
+    it, further restricted to `feasible_arcs` when MATRIX_PRUNE_INFEASIBLE is
+    set. The bucket None (no bucketing) has no particular departure time. Each
+    [location x location] `needed` mask is built only when its bucket is reached."""
+    service_date = bookings[0].pickup_time.date() if bookings else datetime.now(timezone.utc).date()
+
+    num_nodes = len(node_locations)
+    if settings.MATRIX_PRUNE_INFEASIBLE:
+        arcs = feasible_arcs(bookings, locations, node_locations)
+    else:
+        arcs = np.ones((num_nodes, num_nodes), dtype=bool)
+
+    bucket_nodes = {}
+    for node, bucket in enumerate(node_buckets):
+        bucket_nodes.setdefault(bucket, []).append(node)
+
+    node_locations = np.asarray(node_locations)
+    for bucket, nodes in bucket_nodes.items():
+        rows, cols = np.nonzero(arcs[nodes])
+        needed = np.zeros((len(locations), len(locations)), dtype=bool)
+        needed[node_locations[nodes][rows], node_locations[cols]] = True
+        np.fill_diagonal(needed, False)
+        if bucket is None:
+            yield None, needed if settings.MATRIX_PRUNE_INFEASIBLE else None, None
+            continue
+        departure_time = datetime.combine(service_date, dt_time(0, 0), tzinfo=timezone.utc) \
+            + timedelta(seconds=bucket * settings.TIME_BUCKET_SECONDS)
+        yield bucket, needed, departure_time
+
+def build_node_matrices(bookings: List[Booking], locations, node_locations, matrix_provider=None,
+                        existing_matrices=None):
+    """Builds node-level distance & time matrices from per-bucket location matrices.
+
+    Each departure bucket's matrix is fetched lazily, only for the location rows
+    of nodes departing in it, and node row i is read from the bucket of node i.
+    Returns (location_matrices, distance_matrix, time_matrix), where
+    `location_matrices` is {bucket: {"locations", "rows", "distance_matrix",
+    "time_matrix", "estimated"}} (bucket None when bucketing is disabled). Only the
+    rows of locations departing in a bucket are kept ("rows" lists their location
+    indices, the matrices are [rows x locations]), so all buckets together hold
+    about one location matrix. "estimated" is set when the provider failed and
+    the offline estimate was used (see `create_matrices`)."""
+    existing_matrices = existing_matrices or {}
+    node_buckets = node_departure_buckets(bookings, matrix_provider)
+    node_locations = np.asarray(node_locations)
+
+    bucket_nodes = {}
+    for node, bucket in enumerate(node_buckets):
+        bucket_nodes.setdefault(bucket, []).append(node)
+
+    location_matrices = {}
+    estimated = False
+    for bucket, needed, departure_time in bucket_requests(bookings, locations, node_locations, node_buckets):
+        if estimated:
+            # The provider already failed for this request; later buckets take the estimate directly
+            distance, time = get_matrix_provider("haversine").create_matrices(locations)
+        else:
+            distance, time, estimated = create_matrices(locations, matrix_provider, existing_matrices.get(bucket),
+                                                        needed, departure_time)
+        rows = np.unique(node_locations[bucket_nodes[bucket]])
+        location_matrices[bucket] = {
+            "locations": locations,
+            "rows": rows.tolist(),
+            "distance_matrix": distance[rows],
+            "time_matrix": time[rows],
+            "estimated": estimated,
+        }
+
+    # Expand to one row/column per solver node, each row taken from that node's bucket
+    distance_matrix = np.empty((len(node_locations), len(node_locations)), dtype=np.int32)
+    time_matrix = np.empty_like(distance_matrix)
+    row_positions = np.zeros(len(locations), dtype=np.intp)
+    for bucket, matrices in location_matrices.items():
+        nodes = bucket_nodes[bucket]
+        row_positions[matrices["rows"]] = np.arange(len(matrices["rows"]))
+        block = np.ix_(row_positions[node_locations[nodes]], node_locations)
+        distance_matrix[nodes] = matrices["distance_matrix"][block]
+        time_matrix[nodes] = matrices["time_matrix"][block]
+
+    return location_matrices, distance_matrix, time_matrix
+
+def day_matrices_key(bookings: List[Booking], matrix_provider=None) -> str:
+    """Key of the service day of `bookings` in `day_matrices`."""
+    service_date = bookings[0].pickup_time.date() if bookings else datetime.now(timezone.utc).date()
+    return f"{get_matrix_provider(matrix_provider).name}|{service_date.isoformat()}"
+
+def create_data_model(bookings: List[Booking], locations, vehicles: List[VehicleModel], node_locations=None,
+                      matrix_provider=None, existing_matrices=None):
+    """Stores the data for the routing problem.
+
+    `locations` are the unique points from `prepare_locations`; `node_locations`
+    maps every solver node to its location index (identity when omitted).
+    `existing_matrices` is a previous `data["location_matrices"]`; only cells for
+    locations it does not cover are fetched."""
+    if node_locations is None:
+        node_locations = list(range(len(locations)))
+
+    # Build distance & time matrices once per unique location and departure bucket
+    with track_phase("matrix"):
+        location_matrices, distance_matrix, time_matrix = build_node_matrices(
+            bookings, locations, node_locations, matrix_provider, existing_matrices
+        )
 
-def create_data_model(bookings: List[Booking], locations, vehicles: List[VehicleModel]):
-    """Stores the data for the routing problem."""
-    # Build distance & time matrices from Google API response
-    distance_matrix, time_matrix = create_matrices(locations)
-    
     data = {}
     data["bookings"] = bookings
     data["vehicles"] = vehicles
     data["distance_matrix"] = distance_matrix
     data["time_matrix"] = time_matrix
     data["depot"] = 0
+    data["location_matrices"] = location_matrices
+    # Offline estimates stood in for a failed matrix provider
+    data["estimated_matrices"] = any(matrices["estimated"] for matrices in location_matrices.values())
 
     pickups_deliveries = []
     time_windows = []
-    seat_demands = [0]  # depot demand is 0
-    wheelchair_demands = [0]  # depot demand is 0
+    capacity_demands = [0]  # depot demand is 0
     booking_map = {}
 
     # Depot placeholder, will update later
@@ -38,27 +261,17 @@ def create_data_model(bookings: List[Booking], locations, vehicles: List[Vehicle
     for i, booking in enumerate(bookings, start=1):
         booking_id = booking.id
 
-       
-        # Convert pickup and delivery times to seconds
-        pickup_time = (booking.pickup_time.hour * 3600) + (booking.pickup_time.minute * 60) + booking.pickup_time.second
-        delivery_time = (booking.delivery_time.hour * 3600) + (booking.delivery_time.minute * 60) + booking.delivery_time.second
-
-        # pickup window ±25 mins
-        pickup_start = pickup_time - 1500
-        pickup_end = pickup_time + 1500
-
-        # delivery window up to +25 mins
-        delivery_start = delivery_time
-        delivery_end = delivery_time + 1500
+        # pickup window ±25 mins, delivery window up to +25 mins
+        (pickup_start, pickup_end), (delivery_start, delivery_end) = booking_time_windows(booking)
 
         # store booking mapping with demands
         seat_demand = booking.passengers
-        wheelchair_demand = 0 # Assuming no wheelchair demand for simplicity
+        wheelchair_demand = booking.wheelchairs
 
-        seat_demands.append(seat_demand)
-        seat_demands.append(-seat_demand)
-        wheelchair_demands.append(wheelchair_demand)
-        wheelchair_demands.append(-wheelchair_demand)
+        # Effective seats: every wheelchair takes up WHEELCHAIR_SEATS seats
+        capacity_demand = seat_demand + WHEELCHAIR_SEATS * wheelchair_demand
+        capacity_demands.append(capacity_demand)
+        capacity_demands.append(-capacity_demand)
         
 
         booking_map[i * 2 - 1] = {
@@ -97,18 +310,15 @@ def create_data_model(bookings: List[Booking], locations, vehicles: List[Vehicle
     data["time_windows"] = time_windows
     data["booking_map"] = booking_map
     data["num_vehicles"] = len(vehicles)
-    data["seat_capacities"] = [vehicle.total_seats for vehicle in vehicles] # Extract seat capacities from vehicles
-    data["wheelchair_capacities"] = [0] * len(vehicles) # Assuming no wheelchair capacity for simplicity
-    data["seat_demands"] = seat_demands
-    data["wheelchair_demands"] = wheelchair_demands
+    data["capacities"] = [vehicle.total_seats for vehicle in vehicles] # Effective seats per vehicle
+    data["capacity_demands"] = capacity_demands
     return data
 
 def print_solution(data, manager, routing, solution, time_dimension):
-    """Prints solution on console with detailed debug logs for seats and wheelchairs."""
+    """Prints solution on console with detailed debug logs for the occupied effective seats."""
     
-    # Get the capacity dimensions
-    seats_dimension = routing.GetDimensionOrDie("Seats")
-    wheelchair_dimension = routing.GetDimensionOrDie("WheelchairSpaces")
+    # Get the capacity dimension
+    capacity_dimension = routing.GetDimensionOrDie("Capacity")
     
     total_distance = 0
     total_time = 0
@@ -122,19 +332,17 @@ def print_solution(data, manager, routing, solution, time_dimension):
             # Get node and vehicle information
             node_index = manager.IndexToNode(index)
             
-            # Get cumulative values for distance, time, seats, and wheelchairs
+            # Get cumulative values for distance, time and occupied effective seats
             distance_var = routing.GetDimensionOrDie("Distance").CumulVar(index)
             time_var = time_dimension.CumulVar(index)
-            seats_var = seats_dimension.CumulVar(index)
-            wheelchair_var = wheelchair_dimension.CumulVar(index)
+            capacity_var = capacity_dimension.CumulVar(index)
             
             # Print detailed debug logs for the current node
             route_info += (
                 f"  Node {node_index} "
                 f"(Distance: {solution.Value(distance_var)}m, "
                 f"Time: {solution.Value(time_var)}s, "
-                f"Seats: {solution.Value(seats_var)}, "
-                f"Wheelchairs: {solution.Value(wheelchair_var)}) ->\n"
+                f"Effective seats: {solution.Value(capacity_var)}) ->\n"
             )
             
             # Move to the next node in the route
@@ -164,29 +372,224 @@ def print_solution(data, manager, routing, solution, time_dimension):
     print(f"Total Distance of all routes: {total_distance}m")
     print(f"Total Time of all routes: {total_time}s")
 
-def optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel]) -> None:
-    """Optimize pickup and delivery routes with distance + time windows."""
-
-    # Prepare locations (lat,lng) and index map
-    locations, index_map = prepare_locations(bookings_data)
+def solve_time_budget(num_nodes: int, num_vehicles: int, time_limit: float = None,
+                      deadline: datetime = None) -> float:
+    """Seconds the search may run.
+
+    An explicit `time_limit` and/or the time left until `deadline` (the earlier of
+    the two wins); otherwise SOLVER_SECONDS_PER_NODE_VEHICLE per node x vehicle,
+    clamped to [SOLVER_MIN_TIME_LIMIT, SOLVER_MAX_TIME_LIMIT]."""
+    budgets = []
+    if time_limit is not None:
+        budgets.append(time_limit)
+    if deadline is not None:
+        if deadline.tzinfo is None:
+            deadline = deadline.replace(tzinfo=timezone.utc)
+        budgets.append((deadline - datetime.now(timezone.utc)).total_seconds())
+
+    if budgets:
+        budget = min(budgets)
+    else:
+        budget = min(max(num_nodes * num_vehicles * settings.SOLVER_SECONDS_PER_NODE_VEHICLE,
+                         settings.SOLVER_MIN_TIME_LIMIT), settings.SOLVER_MAX_TIME_LIMIT)
+    # Always leave the search enough time to find a first solution
+    return max(1.0, budget)
+
+class StallMonitor:
+    """At-solution callback that finishes the search once the objective has not improved
+    for `stall_seconds`; the best solution found so far is returned."""
+
+    def __init__(self, routing, stall_seconds: float):
+        self.routing = routing
+        self.stall_seconds = stall_seconds
+        self.best_objective = None
+        self.improved_at = time.monotonic()
+        self.stalled = False
+
+    def __call__(self):
+        objective = self.routing.CostVar().Value()
+        now = time.monotonic()
+        if self.best_objective is None or objective < self.best_objective:
+            self.best_objective = objective
+            self.improved_at = now
+        elif now - self.improved_at >= self.stall_seconds:
+            self.stalled = True
+            self.routing.solver().FinishCurrentSearch()
+
+class SolutionReporter:
+    """At-solution callback that hands every improving solution to `on_solution`, in the
+    `extract_solution` format plus "objective", "dropped_count" and "elapsed_seconds"."""
+
+    def __init__(self, data, manager, routing, time_dimension, on_solution):
+        self.data = data
+        self.manager = manager
+        self.routing = routing
+        self.time_dimension = time_dimension
+        self.on_solution = on_solution
+        self.best_objective = None
+        self.started = time.monotonic()
+
+    def Value(self, var):
+        # Stands in for the final assignment in extract_solution: routes are fixed at a
+        # solution, while cumuls are still ranges and report their earliest feasible value
+        return var.Min()
+
+    def __call__(self):
+        objective = self.routing.CostVar().Value()
+        if self.best_objective is not None and objective >= self.best_objective:
+            return
+        self.best_objective = objective
+
+        solution = extract_solution(self.data, self.manager, self.routing, self, self.time_dimension)
+        solution["objective"] = objective
+        solution["dropped_count"] = len(solution["dropped_bookings"])
+        solution["elapsed_seconds"] = round(time.monotonic() - self.started, 3)
+        self.on_solution(solution)
+
+def optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel], matrix_provider=None,
+                    existing_matrices=None, time_limit: float = None, deadline: datetime = None,
+                    previous_clusters: list = None, on_solution=None, stop=None) -> None:
+    """Optimize pickup and delivery routes with distance + time windows.
+
+    `matrix_provider` names the matrix provider to use (default settings.MATRIX_PROVIDER).
+    `existing_matrices` (the per-bucket `data["location_matrices"]`) from an earlier
+    run of the same day is extended instead of rebuilt; when omitted, the matrices
+    kept in `day_matrices` from the last request of that day are used. `time_limit` (seconds of
+    search) and `deadline` bound the solve; see `solve_time_budget`. `previous_clusters`
+    (the `clusters` of an earlier result) seeds the search; see `initial_routes`.
+    More than DECOMPOSITION_MAX_BOOKINGS bookings are planned as parallel sub-problems
+    (see `optimize_decomposed`) unless the request is warm-started, which is solved
+    whole since a previous plan cannot be split over the parts. `on_solution` receives every
+    improving solution while the search runs (see `SolutionReporter`), and setting
+    `stop` (a threading.Event) ends the search with the best solution so far, checked
+    throughout the search rather than only at solutions; streaming implies a single in-process solve, without
+    portfolio or decomposition."""
+    with job_size(len(bookings_data)):
+        if on_solution is None and not previous_clusters and settings.DECOMPOSITION_MAX_BOOKINGS \
+                and len(bookings_data) > settings.DECOMPOSITION_MAX_BOOKINGS:
+            # Imported lazily: the decomposition service builds on this module
+            from services.decomposition_service import optimize_decomposed
+            result = optimize_decomposed(bookings_data, vehicles, matrix_provider, existing_matrices, time_limit,
+                                         deadline)
+        else:
+            result = _optimize_routes(bookings_data, vehicles, matrix_provider, existing_matrices, time_limit,
+                                      deadline, previous_clusters, on_solution, stop)
+        outcome = "solved" if isinstance(result, dict) else "no_solution"
+        OPTIMIZATION_JOBS.labels(current_job_size(), outcome).inc()
+        if isinstance(result, dict):
+            SOLVER_OBJECTIVE.labels(current_job_size()).observe(result["solver"]["objective"])
+            DROPPED_BOOKINGS.labels(current_job_size()).inc(len(result["dropped_bookings"]))
+        return result
+
+def _optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel], matrix_provider=None,
+                     existing_matrices=None, time_limit: float = None, deadline: datetime = None,
+                     previous_clusters: list = None, on_solution=None, stop=None):
+    # Prepare unique locations (lat,lng), node index map and node -> location map
+    locations, index_map, node_locations = prepare_locations(bookings_data)
+
+    # Build problem data, extending the matrices of an earlier request of the same day
+    store_key = day_matrices_key(bookings_data, matrix_provider)
+    data = create_data_model(bookings_data, locations, vehicles, node_locations, matrix_provider,
+                             existing_matrices or day_matrices.get(store_key))
+    if not data["estimated_matrices"]:
+        day_matrices.put(store_key, data["location_matrices"])
+
+    # Budget scaled to the problem unless the request sets a time limit or deadline
+    solve_seconds = solve_time_budget(len(data["distance_matrix"]), data["num_vehicles"], time_limit, deadline)
+    # Worker processes cannot report back while searching, so streamed solves run in-process
+    portfolio = PORTFOLIO_CONFIGS[:1 if on_solution else max(1, settings.SOLVER_PORTFOLIO_SIZE)]
+
+    # Warm start from the previous plan, if any
+    routes = initial_routes(data, previous_clusters) if previous_clusters else None
+    
+    # Debugging: print problem overview
+    print("=== Routing Problem Overview ===")
+    print("Num Vehicles:", data["num_vehicles"])
+    print("Depot:", data["depot"])
+    print("Pickups & Deliveries:", data["pickups_deliveries"])
+    print("Time Windows:", data["time_windows"])
+    print("Capacity Demands:", data["capacity_demands"])
+    print(f"Time Limit: {solve_seconds:.1f}s (stall after {settings.SOLVER_STALL_SECONDS}s)")
+    if routes:
+        print("Warm Start Routes:", routes)
+    print("Search Configurations:", portfolio)
+  
+    print("==============================")
 
-    # Build problem data
-    data = create_data_model(bookings_data, locations, vehicles)
+    # ----------- Solve ----------- #
+    if len(portfolio) > 1:
+        # Workers build their own model, so none is built here
+        with track_phase("solve"):
+            result = solve_portfolio(data, portfolio, solve_seconds, routes)
+        formatted_solution = result["solution"]
+        if formatted_solution is None:
+            print("❌ No solution found!")
+            return "No solution found!"
+        objective = result["objective"]
+        formatted_solution["solver"] = {"config": result["config"], "objective": objective,
+                                        "estimated_matrices": data["estimated_matrices"]}
+    else:
+        build_started = time.perf_counter()
+        manager, routing, time_dimension = build_routing_model(data)
+        observe_phase("model_build", time.perf_counter() - build_started)
+
+        search_params = search_parameters(solve_seconds, portfolio[0])
+        if on_solution:
+            routing.AddAtSolutionCallback(SolutionReporter(data, manager, routing, time_dimension, on_solution))
+        if stop is not None:
+            # A search limit is polled continually, so a stop does not wait for the next solution
+            stop_limit = routing.solver().CustomLimit(stop.is_set)
+            routing.AddSearchMonitor(stop_limit)
+        with track_phase("solve"):
+            solution, stalled = solve_routing_model(routing, search_params, routes)
+        if stalled:
+            print(f"Search stopped: no improvement for {settings.SOLVER_STALL_SECONDS}s")
+        if not solution:
+            print("❌ No solution found!")
+            return "No solution found!"
 
+        print_solution(data, manager, routing, solution,time_dimension)
+        with track_phase("extract"):
+            formatted_solution = extract_solution(data, manager, routing, solution, time_dimension)
+        objective = solution.ObjectiveValue()
+        formatted_solution["solver"] = {"config": portfolio[0], "objective": objective,
+                                        "estimated_matrices": data["estimated_matrices"]}
+
+    return formatted_solution
+
+def matrix_rows(matrix, column_offsets=None) -> list:
+    """Rows of an int node matrix as tuples of Python ints, for RegisterTransitMatrix and
+    fast element access, with `column_offsets` (per column) added to every row.
+
+    `.tolist()` boxes every cell into its own int object (~36 bytes per cell, several
+    GB at 10k nodes); here every cell is a reference to one shared int per distinct
+    value, of which a pruned, rounded matrix has few."""
+    column_offsets = np.zeros(matrix.shape[1], dtype=np.int64) if column_offsets is None else column_offsets
+    values = np.unique(np.add.outer(np.unique(matrix).astype(np.int64), np.unique(column_offsets)))
+    pool = values.tolist()
+    rows = []
+    for row in matrix:
+        indices = np.searchsorted(values, row.astype(np.int64) + column_offsets).tolist()
+        rows.append(tuple(map(pool.__getitem__, indices)))
+    return rows
+
+def build_routing_model(data):
+    """Builds the routing model (dimensions, time windows, pickup & delivery pairs and
+    booking disjunctions) for `create_data_model` data.
+
+    Returns (manager, routing, time_dimension)."""
     # Routing index manager
     manager = pywrapcp.RoutingIndexManager(
-        len(data["distance_matrix"]), data["num_vehicles"], data["depot"]
+        data["distance_matrix"].shape[0], data["num_vehicles"], data["depot"]
     )
 
     routing = pywrapcp.RoutingModel(manager)
 
-    # ----------- Distance Dimension ----------- #
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data["distance_matrix"][from_node][to_node]
+    # Transits are registered as node-indexed matrices / vectors, evaluated natively by
+    # the solver instead of calling back into Python for every arc
 
-    dist_cb_index = routing.RegisterTransitCallback(distance_callback)
+    # ----------- Distance Dimension ----------- #
+    dist_cb_index = routing.RegisterTransitMatrix(matrix_rows(data["distance_matrix"]))
     routing.SetArcCostEvaluatorOfAllVehicles(dist_cb_index)
 
     routing.AddDimension(
@@ -200,13 +603,11 @@ def optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel])
     distance_dimension.SetGlobalSpanCostCoefficient(100)
 
     # ----------- Time Dimension ----------- #
-    def time_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        service_time = 300 if to_node != data["depot"] else 0  # 5 min service at non-depot nodes
-        return data["time_matrix"][from_node][to_node] + service_time
+    # Service time at non-depot nodes, folded into the column of the node being served
+    service_times = np.full(data["time_matrix"].shape[0], SERVICE_TIME_SECONDS, dtype=np.int64)
+    service_times[data["depot"]] = 0
 
-    time_cb_index = routing.RegisterTransitCallback(time_callback)
+    time_cb_index = routing.RegisterTransitMatrix(matrix_rows(data["time_matrix"], service_times))
 
     max_horizon = max(tw[1] for tw in data["time_windows"]) + 86400  # Add buffer
 
@@ -247,58 +648,17 @@ def optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel])
         routing.AddVariableMinimizedByFinalizer(time_dimension.CumulVar(end_index))
 
 
-    # ----------- Seat & Wheelchair Capacity Dimensions ----------- #
-    
-    def seat_demand_callback(from_index):
-        """Returns the demand of the node."""
-        # Convert from routing variable Index to demands NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        return data["seat_demands"][from_node]
-
-    seat_demand_callback_index = routing.RegisterUnaryTransitCallback(seat_demand_callback)
-    routing.AddDimensionWithVehicleCapacity(
-        seat_demand_callback_index,
-        0,  # null capacity slack
-        data["seat_capacities"],  # vehicle maximum capacities
-        True,  # start cumul to zero
-        "Seats",
-    )
-    
-    seats_dimension = routing.GetDimensionOrDie("Seats")
-    
-    def wheelchair_demand_callback(from_index):
-        """Returns the demand of the node."""
-        # Convert from routing variable Index to demands NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        return data["wheelchair_demands"][from_node]
-
-    wheelchair_demand_callback_index = routing.RegisterUnaryTransitCallback(wheelchair_demand_callback)
+    # ----------- Effective Seat Capacity Dimension ----------- #
+    # Passengers plus WHEELCHAIR_SEATS per wheelchair, within the vehicle's total seats
+    # at every point of its route
+    capacity_callback_index = routing.RegisterUnaryTransitVector(data["capacity_demands"])
     routing.AddDimensionWithVehicleCapacity(
-        wheelchair_demand_callback_index,
+        capacity_callback_index,
         0,  # null capacity slack
-        data["wheelchair_capacities"],  # vehicle maximum capacities
+        data["capacities"],  # vehicle maximum capacities
         True,  # start cumul to zero
-        "WheelchairSpaces",
+        "Capacity",
     )
-    wheelchair_dimension = routing.GetDimensionOrDie("WheelchairSpaces")
-   
-   
-   # Add the constraint for each vehicle
-    for vehicle_id in range(data["num_vehicles"]):
-        # The total number of effective seats must not exceed 8 at any point
-        # on the vehicle's route.
-        routing.solver().Add(
-            seats_dimension.CumulVar(routing.End(vehicle_id)) +
-            2 * wheelchair_dimension.CumulVar(routing.End(vehicle_id)) <= 8
-        )
-
-        # To be more precise, this must hold at every node
-        for node_index in range(manager.GetNumberOfNodes()):
-            if node_index != manager.GetNumberOfNodes() - 1: # exclude the last dummy node
-                routing.solver().Add(
-                    seats_dimension.CumulVar(node_index) +
-                    2 * wheelchair_dimension.CumulVar(node_index) <= 8
-                )
 
     # ----------- Pickup & Delivery Constraints ----------- #
     for pickup, delivery in data["pickups_deliveries"]:
@@ -327,7 +687,7 @@ def optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel])
         )
    
     # ----------- Booking Disjunctions (allow skipping) ----------- #
-    penalty = 100000000  # Higher penalty to strongly prefer serving all
+    penalty = DROPPED_BOOKING_PENALTY
     zero_penalty = 0
 
     for pickup, delivery in data["pickups_deliveries"]:
@@ -341,39 +701,125 @@ def optimize_routes(bookings_data: List[Booking], vehicles: List[VehicleModel])
         # Disjunctions: Penalty on delivery (for not serving), free on pickup
         routing.AddDisjunction([delivery_idx], penalty)
         routing.AddDisjunction([pickup_idx], zero_penalty)
-        
 
+    return manager, routing, time_dimension
 
-    # ----------- Search Parameters ----------- #
+def search_parameters(solve_seconds: float, config: dict):
+    """Search parameters for one portfolio configuration within `solve_seconds`."""
     search_params = pywrapcp.DefaultRoutingSearchParameters()
-    search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-
-    search_params.time_limit.seconds = 30
+    search_params.first_solution_strategy = getattr(
+        routing_enums_pb2.FirstSolutionStrategy, config["first_solution_strategy"]
+    )
+    search_params.local_search_metaheuristic = getattr(
+        routing_enums_pb2.LocalSearchMetaheuristic, config["metaheuristic"]
+    )
+    if config.get("gls_lambda") is not None:
+        search_params.guided_local_search_lambda_coefficient = config["gls_lambda"]
+    search_params.time_limit.FromMilliseconds(int(solve_seconds * 1000))
     # search_params.log_search = True
-    
-    # Debugging: print problem overview
-    print("=== Routing Problem Overview ===")
-    print("Num Vehicles:", data["num_vehicles"])
-    print("Depot:", data["depot"])
-    print("Pickups & Deliveries:", data["pickups_deliveries"])
-    print("Time Windows:", data["time_windows"])
-    print("Seat Demands:", data["seat_demands"])
-    print("Wheelchairs Demands:", data["wheelchair_demands"])
-  
-    print("==============================")
+    return search_params
 
-    # ----------- Solve ----------- #
-    solution = routing.SolveWithParameters(search_params)
+def solve_routing_model(routing, search_params, routes=None):
+    """Solves, stopping early once the objective stalls. Returns (solution or None, stalled).
 
-    if solution:
-        print_solution(data, manager, routing, solution,time_dimension)
-        formatted_solution = extract_solution(data, manager, routing, solution, time_dimension)
-        return formatted_solution
-    else:
-        print("❌ No solution found!")
+    `routes` (see `initial_routes`) warm-starts the search from a previous plan; nodes
+    not on them start unperformed and are inserted by the local search."""
+    stall_monitor = StallMonitor(routing, settings.SOLVER_STALL_SECONDS)
+    if settings.SOLVER_STALL_SECONDS:
+        routing.AddAtSolutionCallback(stall_monitor)
 
-    return "No solution found!"
+    if routes and any(routes):
+        routing.CloseModelWithParameters(search_params)
+        initial_assignment = routing.ReadAssignmentFromRoutes(routes, True)
+        if initial_assignment:
+            solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_params)
+            return solution, stall_monitor.stalled
+        print("Previous plan is infeasible for the current bookings, solving from scratch")
+
+    solution = routing.SolveWithParameters(search_params)
+    return solution, stall_monitor.stalled
+
+def initial_routes(data, previous_clusters) -> list:
+    """
+    Maps a previous plan (the `clusters` of `extract_solution`) onto the current nodes.
+
+    Returns one list of node indices per vehicle, following each previous path
+    by booking_id and stop type. Bookings that no longer exist, or whose pickup
+    and dropoff are not both on the same previous route, are left out, as are
+    routes of vehicles no longer in the fleet.
+    """
+    nodes = {}
+    for (pickup, delivery), booking in zip(data["pickups_deliveries"], data["bookings"]):
+        nodes[(booking.id, "Pickup")] = pickup
+        nodes[(booking.id, "Dropoff")] = delivery
+    vehicle_index = {str(vehicle.id): i for i, vehicle in enumerate(data["vehicles"])}
+
+    routes = [[] for _ in range(data["num_vehicles"])]
+    for cluster in previous_clusters or []:
+        vehicle = vehicle_index.get(str(cluster.get("vehicle_id")))
+        if vehicle is None:
+            continue
+        stops = [(stop.get("booking_id"), stop.get("type")) for stop in cluster.get("path", [])]
+        stops = [stop for stop in stops if stop in nodes]
+        complete = {booking_id for booking_id, label in stops
+                    if (booking_id, "Pickup") in stops and (booking_id, "Dropoff") in stops}
+        routes[vehicle] = [nodes[stop] for stop in stops if stop[0] in complete]
+
+    # A node may appear on one route only
+    seen = set()
+    for route in routes:
+        route[:] = [node for node in route if not (node in seen or seen.add(node))]
+    return routes
+
+def solve_with_config(data, config: dict, solve_seconds: float, routes=None) -> dict:
+    """Builds and solves the model for one configuration (run in a portfolio worker process).
+
+    Returns {"config", "objective", "stalled", "solution"}; solution is the
+    `extract_solution` result, or None when nothing feasible was found."""
+    manager, routing, time_dimension = build_routing_model(data)
+    solution, stalled = solve_routing_model(routing, search_parameters(solve_seconds, config), routes)
+    if not solution:
+        return {"config": config, "objective": None, "stalled": stalled, "solution": None}
+    return {
+        "config": config,
+        "objective": solution.ObjectiveValue(),
+        "stalled": stalled,
+        "solution": extract_solution(data, manager, routing, solution, time_dimension),
+    }
+
+def solver_workers() -> int:
+    """Number of solver worker processes (SOLVER_PORTFOLIO_WORKERS, default one per CPU core)."""
+    return settings.SOLVER_PORTFOLIO_WORKERS or os.cpu_count() or 1
+
+def solver_executor() -> ProcessPoolExecutor:
+    """Process pool shared by portfolio and decomposition solves, started on first use."""
+    global _portfolio_pool
+    # Solves run in worker threads, so two first uses can race to start the pool
+    with _portfolio_pool_lock:
+        if _portfolio_pool is None:
+            workers = solver_workers()
+            # Spawned rather than forked: the parent runs threads (geocoding, matrix fetches)
+            _portfolio_pool = ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+    return _portfolio_pool
+
+def solve_portfolio(data, portfolio: list, solve_seconds: float, routes=None) -> dict:
+    """Solves the same problem with every configuration in parallel worker processes and
+    returns the `solve_with_config` result with the lowest objective."""
+    # Workers rebuild the model from the node-level data only
+    worker_data = {key: value for key, value in data.items() if key != "location_matrices"}
+    futures = [solver_executor().submit(solve_with_config, worker_data, config, solve_seconds, routes)
+               for config in portfolio]
+
+    best = {"config": None, "objective": None, "stalled": False, "solution": None}
+    for future in futures:
+        result = future.result()
+        print(f"Portfolio {result['config']}: objective {result['objective']}"
+              f"{' (stalled)' if result['stalled'] else ''}")
+        if result["solution"] is not None and (best["objective"] is None or result["objective"] < best["objective"]):
+            best = result
+    print(f"Portfolio winner: {best['config']}")
+    return best
 
 def extract_solution(data, manager, routing, solution, time_dimension):
     """Return structured clusters with full booking objects, path info, and dropped bookings."""
@@ -454,34 +900,66 @@ def extract_solution(data, manager, routing, solution, time_dimension):
         "dropped_bookings": [data["bookings"][i].id for i in sorted(list(dropped_booking_indices))]
     }
 
+def plan_matrix_requests(bookings_data: List[Booking]) -> dict:
+    """Reports the Distance Matrix requests and billed elements optimizing these bookings would cost,
+    summed over the departure buckets the bookings fall in."""
+    locations, _, node_locations = prepare_locations(bookings_data)
+    node_buckets = node_departure_buckets(bookings_data, "google")
+
+    total = {}
+    buckets = 0
+    for _, needed, departure_time in bucket_requests(bookings_data, locations, node_locations, node_buckets):
+        summary = plan_matrices(locations, needed, departure_time=departure_time)
+        for key, value in summary.items():
+            total[key] = total.get(key, 0) + value
+        buckets += 1
+
+    total["locations"] = len(locations)
+    total["buckets"] = buckets
+    return total
+
 def prepare_locations(bookings_data):
-    """Extract all pickup & delivery locations and create an index map, with a dummy depot at index 0."""
+    """Extract unique pickup & delivery locations and map every solver node onto them.
+
+    Returns `(locations, index_map, node_locations)`: `locations` holds each distinct
+    point once (dummy depot at index 0), `index_map` maps "<booking>_pickup" /
+    "<booking>_delivery" to solver node indices, and `node_locations[node]` is the
+    index into `locations` for that node. Points that round to the same cache key
+    (e.g. return trips, shared destinations) share one location."""
     locations = []
+    location_index = {}
+    node_locations = []
     index_map = {}
 
+    def add_node(coord):
+        key = location_key(coord)
+        if key not in location_index:
+            location_index[key] = len(locations)
+            locations.append(coord)
+        node_locations.append(location_index[key])
+        return len(node_locations) - 1
+
     # Step 1: Add dummy depot at index 0
     dummy_depot = (51.92173421692392, 4.487105575001821)   # or you can put your office coords
-    locations.append(dummy_depot)
-    index_map["depot"] = 0
+    index_map["depot"] = add_node(dummy_depot)
 
     # Step 2: Add pickups & deliveries after depot
     for idx, booking in enumerate(bookings_data):
         if booking.pickup:
             pickup_coord = (booking.pickup.latitude, booking.pickup.longitude)
-            index_map[f"{booking.id}_pickup"] = len(locations)
-            locations.append(pickup_coord)
+            index_map[f"{booking.id}_pickup"] = add_node(pickup_coord)
 
         if booking.delivery:
             delivery_coord = (booking.delivery.latitude, booking.delivery.longitude)
-            index_map[f"{booking.id}_delivery"] = len(locations)
-            locations.append(delivery_coord)
+            index_map[f"{booking.id}_delivery"] = add_node(delivery_coord)
 
-    return locations, index_map
+    return locations, index_map, node_locations
 
 
-async def process_booking_geocoding(booking: Booking, semaphore: asyncio.Semaphore) -> None:
-    """Process geocoding for a single booking with rate limiting"""
-    async with semaphore:  # Limit concurrent requests
+async def process_booking_geocoding(booking: Booking, semaphore: asyncio.Semaphore = None) -> None:
+    """Process geocoding for a single booking; API calls are rate limited process-wide,
+    `semaphore` optionally caps how many bookings of one job are in flight"""
+    async with semaphore or contextlib.nullcontext():
         tasks = []
         
         # Check if pickup geocoding is needed
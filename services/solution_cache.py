@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import List
+
+from core.config import settings
+from core.metrics import SOLUTION_CACHE_REQUESTS
+from models.booking import Booking
+from models.vehicle import VehicleModel
+from services.optimization_service import optimize_routes
+from utils.lru_cache import LruCache
+from utils.single_flight import SingleFlight
+
+
+def request_key(bookings: List[Booking], vehicles: List[VehicleModel], time_limit: float = None,
+                deadline: datetime = None, previous_clusters: list = None) -> str:
+    """
+    SHA-256 of the canonical JSON of an optimization request.
+
+    Bookings and vehicles are dumped in request order (node indices in the result
+    follow it) with sorted keys, together with the solver parameters and the
+    matrix provider, so textual variants of the same request share a key.
+    """
+    request = {
+        "bookings": [booking.model_dump(mode="json") for booking in bookings],
+        "vehicles": [vehicle.model_dump(mode="json") for vehicle in vehicles],
+        "time_limit": time_limit,
+        "deadline": deadline.isoformat() if deadline else None,
+        "previous_clusters": previous_clusters,
+        "matrix_provider": settings.MATRIX_PROVIDER,
+    }
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# Optimization results keyed by `request_key`
+solution_cache = LruCache(settings.SOLUTION_CACHE_SIZE)
+
+# Pending solves by request key, shared by every job in the process
+_solves = SingleFlight()
+
+async def _solve_and_store(key: str, bookings, vehicles, time_limit, deadline, previous_clusters):
+    # Solved in a worker thread so the event loop keeps serving requests meanwhile
+    result = await asyncio.to_thread(optimize_routes, bookings, vehicles, time_limit=time_limit,
+                                     deadline=deadline, previous_clusters=previous_clusters)
+    # Only complete plans on real matrices are kept; "no solution" answers and plans on the
+    # offline estimate of a failed provider are solved again on the next request
+    if isinstance(result, dict) and not result["solver"]["estimated_matrices"]:
+        solution_cache.put(key, result)
+    return result
+
+async def optimize_routes_cached(bookings: List[Booking], vehicles: List[VehicleModel], time_limit: float = None,
+                                 deadline: datetime = None, previous_clusters: list = None):
+    """`optimize_routes` behind the solution cache: identical requests return the stored
+    result, and concurrent identical requests wait on the one solve in flight."""
+    key = request_key(bookings, vehicles, time_limit, deadline, previous_clusters)
+    cached = solution_cache.get(key)
+    if cached is not None:
+        SOLUTION_CACHE_REQUESTS.labels("hit").inc()
+        print(f"Solution cache hit for request {key[:12]}")
+        return cached
+
+    if key in _solves:
+        SOLUTION_CACHE_REQUESTS.labels("shared").inc()
+        print(f"Waiting on the solve in flight for request {key[:12]}")
+    else:
+        SOLUTION_CACHE_REQUESTS.labels("miss").inc()
+    return await _solves.run(key, _solve_and_store, key, bookings, vehicles, time_limit, deadline, previous_clusters)
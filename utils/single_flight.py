@@ -0,0 +1,29 @@
+import asyncio
+from typing import Dict
+
+
+class SingleFlight:
+    """
+    Shares one pending call per key between concurrent coroutines.
+
+    The first caller for a key starts the call; callers arriving while it is in
+    flight await the same result (or exception). The key is released once the
+    call completes, so later calls start afresh.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._in_flight
+
+    async def run(self, key: str, fn, *args):
+        """Awaits `fn(*args)` (a coroutine function) for `key`, or the call already in flight for it."""
+        pending = self._in_flight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(fn(*args))
+            self._in_flight[key] = pending
+            pending.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shielded so one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(pending)